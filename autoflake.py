@@ -27,15 +27,23 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import ast
+import contextlib
 import difflib
 import collections
 import distutils.sysconfig
 import fnmatch
+import hashlib
 import io
+import json
 import os
 import re
 import signal
+import stat
+import struct
 import sys
+import tempfile
+import threading
+import time
 import tokenize
 
 import pyflakes.api
@@ -50,9 +58,32 @@ ATOMS = frozenset([tokenize.NAME, tokenize.NUMBER, tokenize.STRING])
 
 EXCEPT_REGEX = re.compile(r'^\s*except [\s,()\w]+ as \w+:$')
 PYTHON_SHEBANG_REGEX = re.compile(r'^#!.*\bpython[23]?\b\s*$')
+LINE_REGEX = re.compile(r'.*?(?:\r\n|\r|\n)|.+', re.DOTALL)
 
 MAX_PYTHON_FILE_DETECTION_BYTES = 1024
 
+# Estimated fixed cost of handing one file to a worker, in source bytes.
+PER_FILE_COST_BYTES = 2048
+BATCHES_PER_JOB = 4
+
+# Below this much source, starting workers costs more than it saves.
+PARALLEL_MIN_BYTES = 512 * 1024
+THREAD_MIN_BYTES = 64 * 1024
+
+# Seconds to wait for a worker result per poll, where waiting on several
+# connections at once is not supported.
+WORKER_POLL_INTERVAL = 0.05
+
+OUTPUT_CHUNK_SIZE = 64 * 1024
+MAX_PENDING_OUTPUT = 8 * 1024 * 1024
+
+CHECK_CACHE_MAX_ENTRIES = 256
+CHECK_CACHE_MAX_CHARACTERS = 32 * 1024 * 1024
+
+# Unchanged sources take up an entry but no characters.
+FIXED_SOURCE_CACHE_MAX_ENTRIES = 4096
+FIXED_SOURCE_CACHE_MAX_CHARACTERS = 32 * 1024 * 1024
+
 try:
     unicode
 except NameError:
@@ -182,8 +213,135 @@ def create_key_to_messages_dict(messages):
     return dictionary
 
 
+def first_duplicate_key_line_numbers(messages, line_numbers, source):
+    """Return line numbers of the first duplicate of each key in each dict.
+
+    Only duplicates on line_numbers are considered. Removing one duplicate
+    does not affect those in other dictionaries, so the first of each can be
+    removed in the same pass. Duplicates of a key in dictionaries that
+    cannot be told apart are removed one at a time.
+    """
+    dictionaries = {}
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError, RuntimeError):
+        tree = None
+    if tree is not None:
+        for (index, node) in enumerate(ast.walk(tree)):
+            if isinstance(node, ast.Dict):
+                for key in node.keys:
+                    try:
+                        dictionaries[(key.lineno,
+                                      ast.literal_eval(key))] = index
+                    except (AttributeError, SyntaxError, TypeError,
+                            ValueError):
+                        # Dictionary unpacking or a key that is not a
+                        # literal.
+                        pass
+
+    first = {}
+    for message in messages:
+        if (message.lineno in line_numbers and
+                isinstance(message,
+                           pyflakes.messages.MultiValueRepeatedKeyLiteral)):
+            key = message.message_args[0]
+            group = (dictionaries.get((message.lineno, key)), key)
+            first[group] = min(first.get(group, message.lineno),
+                               message.lineno)
+    return frozenset(first.values())
+
+
+def source_hash(source):
+    """Return hex digest identifying the contents of source."""
+    if isinstance(source, unicode):
+        source = source.encode('utf-8', 'surrogatepass')
+    return hashlib.sha1(source).hexdigest()
+
+
+class CheckCache(object):
+    """Least-recently-used cache of pyflakes messages keyed by source hash.
+
+    The cache is bounded both by number of entries and by the total size,
+    in characters, given for its entries. The size of pyflakes messages is
+    the length of the source they were found in, and that of a fixed file
+    is the length of the text held for it. A bound of zero disables caching.
+    It is safe to use from multiple threads. It also holds the results of
+    fixing whole files, for which see fix_file().
+    """
+
+    def __init__(self, max_entries=CHECK_CACHE_MAX_ENTRIES,
+                 max_characters=CHECK_CACHE_MAX_CHARACTERS):
+        """Initialize empty cache."""
+        self.max_entries = max_entries
+        self.max_characters = max_characters
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Return number of cached entries."""
+        return len(self._entries)
+
+    def get(self, key):
+        """Return cached messages for key or None."""
+        with self._lock:
+            try:
+                (messages, size) = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+
+            self._entries[key] = (messages, size)
+            self.hits += 1
+            return messages
+
+    def put(self, key, messages, size):
+        """Store messages for key, evicting least recently used entries."""
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+
+            if self.max_entries <= 0 or size > self.max_characters:
+                return
+
+            self._entries[key] = (messages, size)
+            self.size += size
+
+            while (len(self._entries) > self.max_entries or
+                   self.size > self.max_characters):
+                self.size -= self._entries.popitem(last=False)[1][1]
+
+    def clear(self):
+        """Remove all entries and reset counters."""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+
+
+CHECK_CACHE = CheckCache()
+
+
 def check(source):
-    """Return messages from pyflakes."""
+    """Return messages from pyflakes.
+
+    Results are memoized in CHECK_CACHE. A check interrupted by an
+    exception, such as FileTimeoutError, is not cached.
+    """
+    key = source_hash(source)
+    messages = CHECK_CACHE.get(key)
+    if messages is None:
+        messages = _check(source)
+        CHECK_CACHE.put(key, messages, size=len(source))
+
+    return list(messages)
+
+
+def _check(source):
+    """Return messages from pyflakes without caching."""
     if sys.version_info[0] == 2 and isinstance(source, unicode):
         # Convert back to original byte string encoding, otherwise pyflakes
         # call to compile() will complain. See PEP 263. This only affects
@@ -198,7 +356,7 @@ def check(source):
         pyflakes.api.check(source, filename='<string>', reporter=reporter)
     except (AttributeError, RecursionError, UnicodeDecodeError):
         pass
-    return reporter.messages
+    return tuple(reporter.messages)
 
 
 class StubFile(object):
@@ -327,15 +485,28 @@ def break_up_import(line):
                     for i in sorted(imports.split(','))])
 
 
+Edit = collections.namedtuple('Edit', ['line', 'rule', 'old', 'new'])
+
+# The net change fix_code() made to one line of the original source.
+LineEdit = collections.namedtuple('LineEdit', ['line', 'rules', 'old', 'new'])
+
+
 def filter_code(source, additional_imports=None,
                 expand_star_imports=False,
                 remove_all_unused_imports=False,
                 remove_duplicate_keys=False,
-                remove_unused_variables=False):
-    """Yield code with unused imports removed."""
+                remove_unused_variables=False,
+                edits=None,
+                line_numbers=None):
+    """Yield code with unused imports removed.
+
+    One string is yielded per line of source. If edits is a list, an Edit
+    is appended to it for each line that is changed. If line_numbers is
+    given, all other lines are passed through untouched.
+    """
     imports = SAFE_IMPORTS
     if additional_imports:
-        imports |= frozenset(additional_imports)
+        imports = imports | frozenset(additional_imports)
     del additional_imports
 
     messages = check(source)
@@ -375,6 +546,8 @@ def filter_code(source, additional_imports=None,
     if remove_duplicate_keys:
         marked_key_line_numbers = frozenset(
             duplicate_key_line_numbers(messages, source))
+        first_key_line_numbers = first_duplicate_key_line_numbers(
+            messages, marked_key_line_numbers, source)
     else:
         marked_key_line_numbers = frozenset()
 
@@ -383,25 +556,36 @@ def filter_code(source, additional_imports=None,
     sio = io.StringIO(source)
     previous_line = ''
     for line_number, line in enumerate(sio.readlines(), start=1):
-        if '#' in line:
-            yield line
+        if line_numbers is not None and line_number not in line_numbers:
+            (rule, filtered_line) = (None, line)
+        elif '#' in line:
+            (rule, filtered_line) = (None, line)
         elif line_number in marked_import_line_numbers:
-            yield filter_unused_import(
+            rule = 'unused-import'
+            filtered_line = filter_unused_import(
                 line,
                 unused_module=marked_unused_module[line_number],
                 remove_all_unused_imports=remove_all_unused_imports,
                 imports=imports,
                 previous_line=previous_line)
         elif line_number in marked_variable_line_numbers:
-            yield filter_unused_variable(line)
+            rule = 'unused-variable'
+            filtered_line = filter_unused_variable(line)
         elif line_number in marked_key_line_numbers:
-            yield filter_duplicate_key(line, line_messages[line_number],
-                                       line_number, marked_key_line_numbers,
-                                       source)
+            rule = 'duplicate-key'
+            filtered_line = filter_duplicate_key(
+                line, line_messages[line_number], line_number,
+                first_key_line_numbers, source)
         elif line_number in marked_star_import_line_numbers:
-            yield filter_star_import(line, undefined_names)
+            rule = 'star-import'
+            filtered_line = filter_star_import(line, undefined_names)
         else:
-            yield line
+            (rule, filtered_line) = (None, line)
+
+        if edits is not None and filtered_line != line:
+            edits.append(Edit(line_number, rule, line, filtered_line))
+
+        yield filtered_line
 
         previous_line = line
 
@@ -473,8 +657,11 @@ def filter_unused_variable(line, previous_line=''):
 
 def filter_duplicate_key(line, message, line_number, marked_line_numbers,
                          source, previous_line=''):
-    """Return '' if first occurrence of the key otherwise return `line`."""
-    if marked_line_numbers and line_number == sorted(marked_line_numbers)[0]:
+    """Return '' if first occurrence of the key otherwise return `line`.
+
+    marked_line_numbers holds the first occurrence of each duplicated key.
+    """
+    if line_number in marked_line_numbers:
         return ''
 
     return line
@@ -556,17 +743,26 @@ def useless_pass_line_numbers(source):
         previous_line = line
 
 
-def filter_useless_pass(source):
-    """Yield code with useless "pass" lines removed."""
+def filter_useless_pass(source, edits=None, line_numbers=None):
+    """Yield code with useless "pass" lines removed.
+
+    If edits is a list, an Edit is appended to it for each removed line. If
+    line_numbers is given, only those lines may be removed.
+    """
     try:
         marked_lines = frozenset(useless_pass_line_numbers(source))
     except (SyntaxError, tokenize.TokenError):
         marked_lines = frozenset()
 
+    if line_numbers is not None:
+        marked_lines &= line_numbers
+
     sio = io.StringIO(source)
     for line_number, line in enumerate(sio.readlines(), start=1):
         if line_number not in marked_lines:
             yield line
+        elif edits is not None:
+            edits.append(Edit(line_number, 'useless-pass', line, ''))
 
 
 def get_indentation(line):
@@ -587,10 +783,25 @@ def get_line_ending(line):
         return line[non_whitespace_index:]
 
 
+def count_lines(text):
+    """Return number of lines in text."""
+    return text.count('\n') + (1 if text and not text.endswith('\n') else 0)
+
+
 def fix_code(source, additional_imports=None, expand_star_imports=False,
              remove_all_unused_imports=False, remove_duplicate_keys=False,
-             remove_unused_variables=False):
-    """Return code with all filtering run on it."""
+             remove_unused_variables=False, edits=None, line_numbers=None):
+    """Return code with all filtering run on it.
+
+    If edits is a list, a LineEdit is appended to it for each line of the
+    original source that was changed, in line order. It gives the line's
+    original text, the text deriving from it in the result, and the rules
+    applied, even if it took several passes (for example, an import broken
+    up and then removed).
+
+    If line_numbers is given, only lines deriving from those lines of the
+    original source are changed.
+    """
     if not source:
         return source
 
@@ -598,53 +809,292 @@ def fix_code(source, additional_imports=None, expand_star_imports=False,
     if 'nonlocal' in source:
         remove_unused_variables = False
 
+    # Track the original line number of each line of the current source.
+    tracking = edits is not None or line_numbers is not None
+    origins = list(range(1, count_lines(source) + 1)) if tracking else None
+
+    def allowed_lines():
+        if line_numbers is None:
+            return None
+        return frozenset(line_number
+                         for (line_number, origin) in enumerate(origins, 1)
+                         if origin in line_numbers)
+
+    log = []
+    original_source = source
     filtered_source = None
     while True:
-        filtered_source = ''.join(
-            filter_useless_pass(''.join(
-                filter_code(
-                    source,
-                    additional_imports=additional_imports,
-                    expand_star_imports=expand_star_imports,
-                    remove_all_unused_imports=remove_all_unused_imports,
-                    remove_duplicate_keys=remove_duplicate_keys,
-                    remove_unused_variables=remove_unused_variables))))
+        pass_edits = [] if tracking else None
+        lines = list(filter_code(
+            source,
+            additional_imports=additional_imports,
+            expand_star_imports=expand_star_imports,
+            remove_all_unused_imports=remove_all_unused_imports,
+            remove_duplicate_keys=remove_duplicate_keys,
+            remove_unused_variables=remove_unused_variables,
+            edits=pass_edits,
+            line_numbers=allowed_lines()))
+
+        if tracking:
+            if edits is not None:
+                log.extend(edit._replace(line=origins[edit.line - 1])
+                           for edit in pass_edits)
+            origins = [origin
+                       for (origin, text) in zip(origins, lines)
+                       for _ in range(count_lines(text))]
+            pass_edits = []
+
+        filtered_source = ''.join(filter_useless_pass(
+            ''.join(lines),
+            edits=pass_edits,
+            line_numbers=allowed_lines()))
+
+        if tracking:
+            if edits is not None:
+                log.extend(edit._replace(line=origins[edit.line - 1])
+                           for edit in pass_edits)
+            removed = frozenset(edit.line for edit in pass_edits)
+            origins = [origin
+                       for (line_number, origin) in enumerate(origins, 1)
+                       if line_number not in removed]
 
         if filtered_source == source:
             break
         source = filtered_source
 
+    if edits is not None:
+        edits.extend(coalesce_edits(original_source, filtered_source,
+                                    origins, log))
+
     return filtered_source
 
 
-def fix_file(filename, args, standard_out):
-    """Run fix_code() on a file."""
+def coalesce_edits(source, fixed_source, origins, log):
+    """Return list of LineEdit for the lines of source changed by log.
+
+    log holds the Edits of every pass, numbered by original line, and
+    origins the original line number of each line of fixed_source.
+    """
+    fixed_lines = collections.defaultdict(list)
+    for (origin, line) in zip(origins, io.StringIO(fixed_source)):
+        fixed_lines[origin].append(line)
+
+    rules = collections.defaultdict(list)
+    for edit in log:
+        if edit.rule not in rules[edit.line]:
+            rules[edit.line].append(edit.rule)
+
+    lines = io.StringIO(source).readlines()
+    result = []
+    for line_number in sorted(rules):
+        new = ''.join(fixed_lines[line_number])
+        if new != lines[line_number - 1]:
+            result.append(LineEdit(line_number, rules[line_number],
+                                   lines[line_number - 1], new))
+    return result
+
+
+def fix_code_options(args):
+    """Return fix_code() keyword arguments for parsed command-line args."""
+    return {
+        'additional_imports':
+            args.imports.split(',') if args.imports else None,
+        'expand_star_imports': args.expand_star_imports,
+        'remove_all_unused_imports': args.remove_all_unused_imports,
+        'remove_duplicate_keys': args.remove_duplicate_keys,
+        'remove_unused_variables': args.remove_unused_variables,
+    }
+
+
+def _fixed_source_key(source, options):
+    """Return hashable key identifying source fixed with options."""
+    return (source_hash(source),
+            tuple(sorted(
+                (name, tuple(sorted(value))
+                 if isinstance(value, (list, frozenset)) else value)
+                for (name, value) in options.items())))
+
+
+class FileTimeoutError(BaseException):
+    """Raised when fixing a file takes longer than allowed.
+
+    This is not an Exception, so that pyflakes, which catches those while
+    checking, cannot swallow it and return an incomplete result.
+    """
+
+
+@contextlib.contextmanager
+def time_limit(seconds):
+    """Raise FileTimeoutError if the block runs longer than seconds.
+
+    The limit relies on SIGALRM, so it is only enforced in the main thread
+    on platforms that have it. A false value means no limit.
+    """
+    def timed_out(*_):
+        raise FileTimeoutError(
+            'timed out after {0} seconds'.format(seconds))
+
+    try:
+        if not seconds:
+            raise ValueError('no limit')
+        previous_handler = signal.signal(signal.SIGALRM, timed_out)
+    except (AttributeError, ValueError):
+        # No limit, no SIGALRM, or not in the main thread.
+        yield
+        return
+
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
+
+
+def fix_file(filename, args, standard_out, fixed_sources=None):
+    """Run fix_code() on a file.
+
+    Return (changed, line_count) for the file.
+
+    fixed_sources, if given, is a CheckCache shared across calls. It maps
+    the hash of each source (and options) recently seen to its result so
+    that identical files are usually only fixed once per run, while the
+    memory held stays bounded.
+    """
     encoding = detect_encoding(filename)
     with open_with_encoding(filename, encoding=encoding) as input_file:
         source = input_file.read()
 
+    def write(text):
+        write_file_atomically(filename, text,
+                              encoding=encoding,
+                              fsync=args.fsync == 'file')
+
+    return fix_source(source, filename, args, standard_out, write,
+                      fixed_sources=fixed_sources)
+
+
+def fix_source(source, filename, args, standard_out, write,
+               fixed_sources=None):
+    """Run fix_code() on source read from filename.
+
+    Report changes to standard_out, or pass the fixed source to write() if
+    args.in_place is set. Return (changed, line_count) as fix_file() does.
+    """
     original_source = source
 
-    filtered_source = fix_code(
-        source,
-        additional_imports=args.imports.split(',') if args.imports else None,
-        expand_star_imports=args.expand_star_imports,
-        remove_all_unused_imports=args.remove_all_unused_imports,
-        remove_duplicate_keys=args.remove_duplicate_keys,
-        remove_unused_variables=args.remove_unused_variables)
+    options = fix_code_options(args)
+    if args.changed_lines is not None:
+        options['line_numbers'] = args.changed_lines.get(
+            os.path.realpath(filename), frozenset())
+    edits = [] if args.format == 'json' else None
+    if fixed_sources is None:
+        with time_limit(args.timeout):
+            filtered_source = fix_code(source, edits=edits, **options)
+    else:
+        key = _fixed_source_key(source,
+                                dict(options, edits=edits is not None))
+        cached = fixed_sources.get(key)
+        if cached is None:
+            with time_limit(args.timeout):
+                filtered_source = fix_code(source, edits=edits, **options)
+            # Only hold on to the text of changed sources; most files are
+            # left alone.
+            if filtered_source == source:
+                fixed_sources.put(key, (), 0)
+            else:
+                fixed_sources.put(
+                    key, (filtered_source, edits),
+                    len(filtered_source) +
+                    sum(len(edit.old) + len(edit.new)
+                        for edit in edits or []))
+        elif cached:
+            (filtered_source, edits) = cached
+        else:
+            filtered_source = original_source
 
     if original_source != filtered_source:
         if args.in_place:
-            with open_with_encoding(filename, mode='w',
-                                    encoding=encoding) as output_file:
-                output_file.write(filtered_source)
-        else:
+            write(filtered_source)
+
+        if edits is not None:
+            standard_out.write(json.dumps(
+                {'filename': filename,
+                 'edits': [edit._asdict() for edit in edits]},
+                sort_keys=True) + '\n')
+        elif not args.in_place:
             diff = get_diff_text(
                 io.StringIO(original_source).readlines(),
                 io.StringIO(filtered_source).readlines(),
                 filename)
             standard_out.write(''.join(diff))
 
+    return (original_source != filtered_source,
+            original_source.count('\n'))
+
+
+def write_file_atomically(filename, text, encoding, fsync=False):
+    """Replace contents of filename with text.
+
+    The text is written to a temporary file in the same directory, which
+    then takes the place of the original, so an interrupted write never
+    leaves a truncated file behind. Permission bits are kept, and if
+    filename is a symbolic link its target is replaced. A file with more
+    than one hard link is rewritten in place instead, as replacing it
+    would leave its other names with the old contents. If fsync is True,
+    the data and the directory entry are flushed to disk before returning.
+    """
+    path = os.path.realpath(filename)
+    if os.stat(path).st_nlink > 1:
+        with io.open(path, mode='w', encoding=encoding,
+                     newline='') as output_file:
+            output_file.write(text)
+            if fsync:
+                output_file.flush()
+                os.fsync(output_file.fileno())
+        return
+
+    directory = os.path.dirname(path)
+    (descriptor, temporary_path) = tempfile.mkstemp(
+        dir=directory,
+        prefix='.' + os.path.basename(path) + '.',
+        suffix='.tmp')
+    try:
+        with io.open(descriptor, mode='w', encoding=encoding,
+                     newline='') as output_file:
+            output_file.write(text)
+            if fsync:
+                output_file.flush()
+                os.fsync(output_file.fileno())
+
+        os.chmod(temporary_path, stat.S_IMODE(os.stat(path).st_mode))
+        getattr(os, 'replace', os.rename)(temporary_path, path)
+    except BaseException:
+        try:
+            os.remove(temporary_path)
+        except OSError:  # pragma: no cover
+            pass
+        raise
+
+    if fsync:
+        try:
+            directory_descriptor = os.open(directory, os.O_RDONLY)
+        except OSError:  # pragma: no cover
+            # Directories cannot be opened on Windows.
+            return
+        try:
+            os.fsync(directory_descriptor)
+        finally:
+            os.close(directory_descriptor)
+
+
+def sync_file_systems():
+    """Flush all file system buffers to disk, where supported."""
+    try:
+        os.sync()
+    except AttributeError:  # pragma: no cover
+        pass
+
 
 def open_with_encoding(filename, encoding, mode='r',
                        limit_byte_check=-1):
@@ -729,8 +1179,8 @@ def is_python_file(filename):
     return True
 
 
-def match_file(filename, exclude):
-    """Return True if file is okay for modifying/recursing."""
+def match_name(filename, exclude):
+    """Return True if filename is neither hidden nor excluded."""
     base_name = os.path.basename(filename)
 
     if base_name.startswith('.'):
@@ -742,28 +1192,1564 @@ def match_file(filename, exclude):
         if fnmatch.fnmatch(filename, pattern):
             return False
 
+    return True
+
+
+def match_file(filename, exclude):
+    """Return True if file is okay for modifying/recursing."""
+    if not match_name(filename, exclude):
+        return False
+
     if not os.path.isdir(filename) and not is_python_file(filename):
         return False
 
     return True
 
 
-def find_files(filenames, recursive, exclude):
-    """Yield filenames."""
+def file_identity(filename):
+    """Return (device, inode) pair of filename or None if unknown."""
+    try:
+        status = os.stat(filename)
+    except OSError:
+        return None
+
+    if not status.st_ino:
+        # Not all platforms report inode numbers.
+        return None  # pragma: no cover
+
+    return (status.st_dev, status.st_ino)
+
+
+def find_files(filenames, recursive, exclude, directories=None):
+    """Yield filenames.
+
+    Files and directories reachable through more than one path (overlapping
+    arguments, symbolic links or hard links) are only yielded or walked once.
+    If directories is a list, each directory walked is appended to it.
+    Directories are walked in sorted order, so that files are yielded in the
+    same order on every run and every file system.
+    """
+    seen = set()
+
+    def first_visit(name):
+        identity = file_identity(name)
+        if identity is None:
+            return True
+        if identity in seen:
+            return False
+        seen.add(identity)
+        return True
+
     while filenames:
         name = filenames.pop(0)
+        if not first_visit(name):
+            continue
+
         if recursive and os.path.isdir(name):
-            for root, directories, children in os.walk(name):
-                filenames += [os.path.join(root, f) for f in children
+            for root, subdirectories, children in os.walk(name):
+                if directories is not None:
+                    directories.append(root)
+                filenames += [os.path.join(root, f) for f in sorted(children)
                               if match_file(os.path.join(root, f),
                                             exclude)]
-                directories[:] = [d for d in directories
-                                  if match_file(os.path.join(root, d),
-                                                exclude)]
+                # Symbolic links to directories are not walked, so they must
+                # not shadow their targets.
+                subdirectories[:] = [d for d in sorted(subdirectories)
+                                     if match_file(os.path.join(root, d),
+                                                   exclude) and
+                                     (os.path.islink(os.path.join(root, d)) or
+                                      first_visit(os.path.join(root, d)))]
         else:
             yield name
 
 
+FileResult = collections.namedtuple(
+    'FileResult', ['filename', 'output', 'error', 'changed', 'lines'])
+
+
+def fix_batch(filenames, args, fixed_sources=None):
+    """Return list of FileResult from running fix_file() on filenames."""
+    results = []
+    for name in filenames:
+        output = io.StringIO()
+        try:
+            (changed, lines) = fix_file(name, args=args, standard_out=output,
+                                        fixed_sources=fixed_sources)
+            results.append(
+                FileResult(name, output.getvalue(), None, changed, lines))
+        except IOError as exception:
+            results.append(FileResult(name, output.getvalue(),
+                                      unicode(exception), False, 0))
+        except FileTimeoutError as exception:
+            results.append(
+                FileResult(name, '',
+                           '{0}: {1}; skipped'.format(name, exception),
+                           False, 0))
+    return results
+
+
+def file_sizes(filenames):
+    """Return dictionary mapping filenames to their size in bytes.
+
+    Files that cannot be read are given a size of 0.
+    """
+    sizes = {}
+    for name in filenames:
+        try:
+            sizes[name] = os.path.getsize(name)
+        except OSError:
+            sizes[name] = 0
+    return sizes
+
+
+def schedule_batches(filenames, jobs, sizes=None):
+    """Return filenames grouped into batches for jobs workers.
+
+    Batches are ordered longest first (the LPT heuristic) so that a single
+    huge file cannot start last and stretch the run. Files are costed by
+    their size plus a fixed per-file overhead; files much smaller than a
+    fair share of the total are packed together to amortize that overhead.
+    """
+    if sizes is None:
+        sizes = file_sizes(filenames)
+
+    costed = [(sizes[name] + PER_FILE_COST_BYTES, name)
+              for name in filenames]
+
+    costed.sort(key=lambda item: item[0], reverse=True)
+
+    target = sum(cost for (cost, _) in costed) // (jobs * BATCHES_PER_JOB)
+
+    batches = []
+    batch = []
+    batch_cost = 0
+    for (cost, name) in costed:
+        if cost >= target:
+            batches.append([name])
+            continue
+
+        batch.append(name)
+        batch_cost += cost
+        if batch_cost >= target:
+            batches.append(batch)
+            batch = []
+            batch_cost = 0
+
+    if batch:
+        batches.append(batch)
+
+    return batches
+
+
+def available_cpus():
+    """Return number of CPUs this process may run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # pragma: no cover
+        import multiprocessing
+        try:
+            return multiprocessing.cpu_count()
+        except NotImplementedError:
+            return 1
+
+
+def gil_enabled():
+    """Return True unless running on a free-threaded interpreter."""
+    try:
+        return sys._is_gil_enabled()
+    except AttributeError:
+        return True
+
+
+def plan_execution(file_count, total_bytes, jobs=0, cpus=None,
+                   threads=False, timeout=None):
+    """Return (strategy, workers) for fixing the given amount of source.
+
+    strategy is 'serial', 'threads' or 'processes'. A jobs value of 0
+    picks the number of workers automatically, falling back to serial
+    execution when the run is too small for workers to pay off.
+
+    Threads are used when the interpreter runs without a GIL or when
+    threads is True. Under a GIL, threads cannot run fixes in parallel, so
+    an automatic plan then falls back to serial execution. A timeout can
+    only be enforced in a main thread, so with one, processes are used
+    instead of threads.
+    """
+    if jobs == 1 or file_count <= 1:
+        return ('serial', 1)
+
+    use_threads = not timeout and (threads or not gil_enabled())
+
+    if not jobs:
+        if use_threads and gil_enabled():
+            return ('serial', 1)
+
+        if cpus is None:
+            cpus = available_cpus()
+
+        jobs = min(cpus, file_count)
+        minimum_bytes = (THREAD_MIN_BYTES if use_threads
+                         else PARALLEL_MIN_BYTES)
+        if jobs <= 1 or total_bytes < minimum_bytes:
+            return ('serial', 1)
+
+    return ('threads' if use_threads else 'processes', jobs)
+
+
+def peak_memory():
+    """Return peak resident set size of this process in bytes.
+
+    Return 0 if this is unknown.
+    """
+    try:
+        import resource
+    except ImportError:  # pragma: no cover
+        return 0
+
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':  # pragma: no cover
+        return usage
+    return usage * 1024
+
+
+def _fix_batch_reporting_errors(batch, args, fixed_sources):
+    """Return fix_batch() results, with any unexpected error as a result."""
+    try:
+        return fix_batch(batch, args, fixed_sources=fixed_sources)
+    except Exception:  # pragma: no cover
+        # Report rather than leave the parent waiting for this batch.
+        import traceback
+        error = traceback.format_exc().rstrip()
+        return [FileResult(name, '', name + ': ' + error, False, 0)
+                for name in batch]
+
+
+def _fix_files_in_threads(batches, args, jobs):
+    """Yield FileResult for each file in batches fixed by jobs threads.
+
+    Batches and results are handed between threads as they are, without
+    being pickled.
+    """
+    import multiprocessing.dummy
+
+    fixed_sources = CheckCache(
+        max_entries=FIXED_SOURCE_CACHE_MAX_ENTRIES,
+        max_characters=FIXED_SOURCE_CACHE_MAX_CHARACTERS)
+    pool = multiprocessing.dummy.Pool(jobs)
+    try:
+        for results in pool.imap_unordered(
+                lambda batch: _fix_batch_reporting_errors(batch, args,
+                                                          fixed_sources),
+                batches):
+            for result in results:
+                yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _parallel_worker(connection, args, max_files=0, max_memory=0):
+    """Fix batches received on connection until it receives None.
+
+    Each batch is answered with (results, retiring). The worker retires,
+    setting retiring, once it has fixed max_files files or its peak memory
+    use reaches max_memory bytes.
+    """
+    try:
+        # Let the parent handle Ctrl-C.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+    except ValueError:  # pragma: no cover
+        # Not in the main thread.
+        pass
+
+    fixed_sources = CheckCache(
+        max_entries=FIXED_SOURCE_CACHE_MAX_ENTRIES,
+        max_characters=FIXED_SOURCE_CACHE_MAX_CHARACTERS)
+    processed = 0
+    for batch in iter(connection.recv, None):
+        results = _fix_batch_reporting_errors(batch, args, fixed_sources)
+        processed += len(batch)
+        retiring = bool((max_files and processed >= max_files) or
+                        (max_memory and peak_memory() >= max_memory))
+        connection.send((results, retiring))
+        if retiring:
+            return
+
+
+def _ready_connections(connections):
+    """Return those of connections that can be read without blocking."""
+    try:
+        from multiprocessing.connection import wait
+    except ImportError:  # pragma: no cover
+        # Python 2.
+        while True:
+            ready = [connection for connection in connections
+                     if connection.poll(WORKER_POLL_INTERVAL)]
+            if ready:
+                return ready
+    return wait(connections)
+
+
+def multiprocessing_context():
+    """Return multiprocessing context to start worker processes from.
+
+    Where available, workers are forked from a forkserver that has already
+    imported this module, and with it pyflakes, difflib and the
+    SAFE_IMPORTS table. Each worker then starts warm instead of paying for
+    those imports again, and no worker is forked from a parent that may
+    be running threads.
+    """
+    import multiprocessing
+
+    try:
+        context = multiprocessing.get_context('forkserver')
+    except (AttributeError, ValueError):  # pragma: no cover
+        # Python 2 or a platform without forkserver.
+        return multiprocessing
+
+    if __name__ == '__main__':
+        # Workers of a script run this module as their __main__. Preloading
+        # '__main__' has the forkserver import it once, so that workers do
+        # not each re-run it as __mp_main__. Python versions that ignore
+        # '__main__' here still get the imports warm through 'autoflake'.
+        context.set_forkserver_preload(['__main__', 'autoflake'])
+    else:
+        context.set_forkserver_preload([__name__])
+    return context
+
+
+def fix_files_in_parallel(batches, args, jobs, threads=False,
+                          max_files=0, max_memory=0):
+    """Yield FileResult for each file in batches fixed by jobs workers.
+
+    Workers are processes, or threads if threads is True. Worker processes
+    are replaced by fresh ones after fixing max_files files or reaching
+    max_memory bytes of peak memory; retiring a thread would free nothing.
+    Results are yielded as batches complete. If a worker process dies, the
+    files of the batch it held are reported as failed and a replacement is
+    started.
+    """
+    if threads:
+        for result in _fix_files_in_threads(batches, args, jobs):
+            yield result
+        return
+
+    import multiprocessing
+
+    context = multiprocessing_context()
+    batches = list(batches)
+    queued = collections.deque(range(len(batches)))
+
+    # Each worker has a pipe of its own and is sent one batch at a time. A
+    # worker that dies closes its end, so the parent knows which batch was
+    # lost, and cannot leave a lock shared with other workers held.
+    workers = {}
+    stopped = []
+
+    def assign(connection):
+        if queued:
+            index = queued.popleft()
+            workers[connection][1] = index
+            connection.send(batches[index])
+        else:
+            connection.send(None)
+            stopped.append(workers.pop(connection)[0])
+
+    def start_worker():
+        (connection, worker_connection) = multiprocessing.Pipe()
+        worker = context.Process(
+            target=_parallel_worker,
+            args=(worker_connection, args, max_files, max_memory))
+        worker.daemon = True
+        worker.start()
+        worker_connection.close()
+        workers[connection] = [worker, None]
+        assign(connection)
+
+    for _ in range(min(jobs, len(batches))):
+        start_worker()
+
+    while workers:
+        for connection in _ready_connections(list(workers)):
+            (worker, index) = workers[connection]
+            try:
+                (results, retiring) = connection.recv()
+            except (EOFError, IOError, OSError):
+                # The worker died without reporting its batch.
+                del workers[connection]
+                worker.join()
+                results = [
+                    FileResult(name, '',
+                               '{0}: worker exited unexpectedly (exit code '
+                               '{1}); skipped'.format(name, worker.exitcode),
+                               False, 0)
+                    for name in batches[index]]
+                retiring = True
+            else:
+                if retiring:
+                    # A retired worker is replaced by a fresh one.
+                    del workers[connection]
+                    worker.join()
+                else:
+                    assign(connection)
+
+            if retiring:
+                connection.close()
+                if queued:
+                    start_worker()
+
+            for result in results:
+                yield result
+
+    for worker in stopped:
+        worker.join()
+
+
+class OrderedWriter(object):
+    """Write outputs to a stream in sequence order.
+
+    Outputs may be added in any order. Each is written once all outputs
+    with lower sequence numbers have been, so the stream does not depend
+    on which worker finished first. Writes are coalesced into chunks of
+    about chunk_size characters. Outputs that arrive early are held in
+    memory up to max_pending characters and spilled to a temporary file
+    beyond that.
+    """
+
+    def __init__(self, stream, chunk_size=OUTPUT_CHUNK_SIZE,
+                 max_pending=MAX_PENDING_OUTPUT):
+        """Initialize writer for stream."""
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.max_pending = max_pending
+        self._next_index = 0
+        self._pending = {}
+        self._pending_size = 0
+        self._spill_file = None
+        self._chunk = []
+        self._chunk_size = 0
+
+    def add(self, index, text):
+        """Queue text as the output with sequence number index."""
+        if index != self._next_index:
+            if (text and
+                    self._pending_size + len(text) > self.max_pending):
+                self._pending[index] = self._spill(text)
+            else:
+                self._pending[index] = text
+                self._pending_size += len(text)
+            return
+
+        self._write(text)
+        self._next_index += 1
+
+        while self._next_index in self._pending:
+            text = self._pending.pop(self._next_index)
+            if isinstance(text, tuple):
+                text = self._unspill(*text)
+            else:
+                self._pending_size -= len(text)
+            self._write(text)
+            self._next_index += 1
+
+    def flush(self):
+        """Write everything buffered so far that is in sequence."""
+        if self._chunk:
+            self.stream.write(''.join(self._chunk))
+            self._chunk = []
+            self._chunk_size = 0
+
+    def close(self):
+        """Flush and release the spill file."""
+        self.flush()
+        if self._spill_file:
+            self._spill_file.close()
+            self._spill_file = None
+
+    def _write(self, text):
+        if not text:
+            return
+
+        self._chunk.append(text)
+        self._chunk_size += len(text)
+        if self._chunk_size >= self.chunk_size:
+            self.flush()
+
+    def _spill(self, text):
+        if not self._spill_file:
+            self._spill_file = tempfile.TemporaryFile()
+
+        data = text.encode('utf-8', 'surrogatepass')
+        self._spill_file.seek(0, os.SEEK_END)
+        offset = self._spill_file.tell()
+        self._spill_file.write(data)
+        return (offset, len(data))
+
+    def _unspill(self, offset, length):
+        self._spill_file.seek(offset)
+        return self._spill_file.read(length).decode('utf-8', 'surrogatepass')
+
+
+class Progress(object):
+    """Report progress of a run on a terminal.
+
+    The status line shows files discovered, processed and changed, along
+    with throughput and an estimated time remaining. It is redrawn at most
+    once every interval seconds.
+    """
+
+    def __init__(self, stream, interval=0.2, clock=time.time):
+        """Initialize reporter writing to stream."""
+        self.stream = stream
+        self.interval = interval
+        self.clock = clock
+        self.discovered = 0
+        self.processed = 0
+        self.changed = 0
+        self.lines = 0
+        self._start = clock()
+        self._last_render = None
+        self._shown = False
+
+    def discover(self):
+        """Count one more discovered file."""
+        self.discovered += 1
+        self._maybe_render()
+
+    def update(self, result):
+        """Count processed FileResult."""
+        self.processed += 1
+        self.changed += result.changed
+        self.lines += result.lines
+        self._maybe_render()
+
+    def status(self):
+        """Return status line text."""
+        elapsed = max(self.clock() - self._start, 1e-6)
+        files_per_second = self.processed / elapsed
+        if files_per_second and self.discovered >= self.processed:
+            eta = '{0:.0f}s'.format(
+                (self.discovered - self.processed) / files_per_second)
+        else:
+            eta = '?'
+
+        return ('{0}/{1} files, {2} changed, {3:.0f} files/s, '
+                '{4:.0f} lines/s, ETA {5}'.format(
+                    self.processed, self.discovered, self.changed,
+                    files_per_second, self.lines / elapsed, eta))
+
+    def render(self):
+        """Redraw status line."""
+        self.stream.write('\r\x1b[K' + self.status())
+        self.stream.flush()
+        self._last_render = self.clock()
+        self._shown = True
+
+    def clear(self):
+        """Erase status line so other output can be printed."""
+        if self._shown:
+            self.stream.write('\r\x1b[K')
+            self.stream.flush()
+            self._shown = False
+
+    def finish(self):
+        """Draw final status line and end it."""
+        self.render()
+        self.stream.write('\n')
+        self.stream.flush()
+        self._shown = False
+
+    def _maybe_render(self):
+        if (self._last_render is None or
+                self.clock() - self._last_render >= self.interval):
+            self.render()
+
+
+def _counted(items, progress):
+    """Yield items, counting them as discovered files."""
+    for item in items:
+        progress.discover()
+        yield item
+
+
+class Journal(object):
+    """Append-only record of files completed by earlier runs.
+
+    Each line holds a hash of a file's contents after it was processed
+    (salted with a fingerprint of the options used) and the file's absolute
+    path. A file whose current contents still hash to the recorded value
+    needs no further work. Only one thread appends at a time; superseded
+    lines are dropped by a background compaction once they outnumber the
+    live ones.
+    """
+
+    compact_min_lines = 1000
+
+    def __init__(self, path, fingerprint):
+        """Load journal at path, creating it if necessary."""
+        self.path = path
+        self.fingerprint = fingerprint.encode('utf-8')
+        self._completed = {}
+        self._lines = 0
+        self._updated = set()
+        self._compactor = None
+        self._lock = threading.Lock()
+
+        try:
+            with io.open(path, encoding='utf-8') as journal_file:
+                for line in journal_file:
+                    # An interrupted run may leave a partial last line.
+                    if line.endswith('\n') and '\t' in line:
+                        (digest, name) = line[:-1].split('\t', 1)
+                        self._completed[name] = digest
+                        self._lines += 1
+        except IOError:
+            pass
+
+        self._file = io.open(path, mode='a', encoding='utf-8')
+
+    def digest(self, filename):
+        """Return hash of contents of filename or None if unreadable."""
+        try:
+            with open(filename, 'rb') as input_file:
+                data = input_file.read()
+        except IOError:
+            return None
+        return hashlib.sha1(self.fingerprint + b'\0' + data).hexdigest()
+
+    def is_complete(self, filename, digest):
+        """Return True if filename was completed with contents digest."""
+        return self._completed.get(os.path.abspath(filename)) == digest
+
+    def record(self, filename, digest):
+        """Record that filename is complete with contents digest."""
+        name = os.path.abspath(filename)
+        line = digest + '\t' + name + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self._completed[name] = digest
+            self._lines += 1
+            if self._compactor:
+                self._updated.add(name)
+            elif (self._lines >= self.compact_min_lines and
+                    self._lines > 2 * len(self._completed)):
+                self._compactor = threading.Thread(target=self._compact)
+                self._compactor.daemon = True
+                self._compactor.start()
+
+    def close(self):
+        """Wait for any compaction and close the journal."""
+        if self._compactor:
+            self._compactor.join()
+        self._file.close()
+
+    def _compact(self):
+        with self._lock:
+            completed = dict(self._completed)
+
+        (descriptor, temporary_path) = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(self.path)),
+            prefix='.' + os.path.basename(self.path) + '.',
+            suffix='.tmp')
+        with io.open(descriptor, mode='w', encoding='utf-8') as output_file:
+            for (name, digest) in sorted(completed.items()):
+                output_file.write(digest + '\t' + name + '\n')
+
+            with self._lock:
+                # Carry over files recorded while the snapshot was written.
+                # Later lines take precedence when the journal is loaded.
+                for name in sorted(self._updated):
+                    output_file.write(
+                        self._completed[name] + '\t' + name + '\n')
+                output_file.close()
+
+                getattr(os, 'replace', os.rename)(temporary_path, self.path)
+                self._file.close()
+                self._file = io.open(self.path, mode='a', encoding='utf-8')
+                self._lines = len(completed) + len(self._updated)
+                self._updated = set()
+                self._compactor = None
+
+
+def journal_fingerprint(args):
+    """Return text identifying the options that affect a file's result.
+
+    With --diff-only, the lines fixed depend on a file's contents and on
+    the commit it is compared with, so the commit is part of the result.
+    """
+    options = dict(fix_code_options(args), in_place=args.in_place)
+    if args.diff_only:
+        options['diff_only'] = args.diff_only
+    return json.dumps(options, sort_keys=True)
+
+
+def unique(items):
+    """Return list of items without duplicates, keeping the first of each."""
+    seen = set()
+    result = []
+    for item in items:
+        if item not in seen:
+            seen.add(item)
+            result.append(item)
+    return result
+
+
+HUNK_REGEX = re.compile(br'^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@')
+
+GIT_ESCAPES = {b'a': b'\a', b'b': b'\b', b'f': b'\f', b'n': b'\n',
+               b'r': b'\r', b't': b'\t', b'v': b'\v', b'"': b'"',
+               b'\\': b'\\'}
+GIT_ESCAPE_REGEX = re.compile(br'\\([0-7]{3}|.)')
+
+
+def git_unquote(path):
+    """Return path from a git diff header, undoing git's C-style quoting."""
+    if not (path.startswith(b'"') and path.endswith(b'"')):
+        return path
+
+    def unescape(match):
+        escape = match.group(1)
+        if len(escape) == 3:
+            return struct.pack('B', int(escape, 8))
+        return GIT_ESCAPES.get(escape, escape)
+
+    return GIT_ESCAPE_REGEX.sub(unescape, path[1:-1])
+
+
+def git_commit(ref):
+    """Return name of the commit ref refers to.
+
+    Raise subprocess.CalledProcessError or OSError if git fails.
+    """
+    import subprocess
+
+    return subprocess.check_output(
+        ['git', 'rev-parse', '--verify', ref + '^{commit}'],
+        stderr=subprocess.PIPE).decode('ascii').strip()
+
+
+def git_changed_lines(ref):
+    """Return dictionary mapping files to line numbers changed since ref.
+
+    Keys are real paths. Line numbers refer to the working tree. Raise
+    subprocess.CalledProcessError or OSError if git fails.
+    """
+    import subprocess
+
+    top_level = subprocess.check_output(
+        ['git', 'rev-parse', '--show-toplevel']).rstrip(b'\n')
+    output = subprocess.check_output(
+        ['git', '-c', 'core.quotePath=off', 'diff', '--no-color',
+         '--no-ext-diff', '--src-prefix=a/', '--dst-prefix=b/', '-U0',
+         ref, '--'],
+        cwd=top_level)
+
+    changed = {}
+    lines = None
+    for line in output.splitlines():
+        if line.startswith(b'+++ '):
+            # git ends the header with a tab if the path has a space.
+            path = git_unquote(line[4:].rstrip(b'\t'))
+            if path.startswith(b'b/'):
+                path = os.path.realpath(os.path.join(top_level, path[2:]))
+                lines = changed.setdefault(
+                    path.decode(sys.getfilesystemencoding()), set())
+            else:
+                # Deleted file.
+                lines = None
+        elif lines is not None:
+            match = HUNK_REGEX.match(line)
+            if match:
+                start = int(match.group(1))
+                count = int(match.group(2) or 1)
+                lines.update(range(start, start + count))
+
+    return dict((path, frozenset(lines)) for (path, lines) in changed.items())
+
+
+def git_staged_files(cwd=None):
+    """Return list of (path, mode, blob) for staged regular files.
+
+    Only added and modified files are listed. Paths are relative to the top
+    level of the repository. All values are bytes. Raise
+    subprocess.CalledProcessError or OSError if git fails.
+    """
+    import subprocess
+
+    output = subprocess.check_output(
+        ['git', 'diff', '--cached', '--raw', '-z', '--no-abbrev',
+         '--no-renames', '--diff-filter=AM'],
+        cwd=cwd)
+
+    fields = output.split(b'\0')
+    staged = []
+    for (status, path) in zip(fields[0::2], fields[1::2]):
+        (_, mode, _, blob, _) = status.split(b' ')
+        # Skip symbolic links and submodules.
+        if mode in (b'100644', b'100755'):
+            staged.append((path, mode, blob))
+    return staged
+
+
+def git_blobs(blobs, cwd=None):
+    """Yield contents of each git object in blobs, in order.
+
+    All objects are read through a single "git cat-file --batch" process.
+    Object names are fed to it from a separate thread, so git never waits
+    for the caller to ask for the next one. Raise ValueError if an object
+    is missing.
+    """
+    import subprocess
+
+    blobs = list(blobs)
+    process = subprocess.Popen(['git', 'cat-file', '--batch'],
+                               stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE,
+                               cwd=cwd)
+
+    def feed():
+        try:
+            for blob in blobs:
+                process.stdin.write(blob + b'\n')
+            process.stdin.close()
+        except IOError:
+            # The reader stopped early.
+            pass
+
+    feeder = threading.Thread(target=feed)
+    feeder.daemon = True
+    feeder.start()
+
+    try:
+        for blob in blobs:
+            header = process.stdout.readline().split()
+            if len(header) != 3:
+                raise ValueError('git could not read object {0}'.format(
+                    blob.decode('ascii', 'replace')))
+            data = process.stdout.read(int(header[2]))
+            process.stdout.read(1)
+            yield data
+    finally:
+        process.stdout.close()
+        feeder.join()
+        process.wait()
+
+
+def git_write_blobs(contents, cwd=None):
+    """Write each of contents to the git object store and return their names.
+
+    All objects are written by a single "git hash-object" process, which
+    reads them from temporary files. Contents are stored as given, without
+    filters. Raise subprocess.CalledProcessError or OSError if git fails.
+    """
+    import shutil
+    import subprocess
+
+    directory = tempfile.mkdtemp(prefix='autoflake.')
+    try:
+        paths = []
+        for (index, data) in enumerate(contents):
+            path = os.path.join(directory, str(index))
+            with open(path, 'wb') as output_file:
+                output_file.write(data)
+            paths.append(path)
+        if not paths:
+            return []
+
+        process = subprocess.Popen(
+            ['git', 'hash-object', '-w', '--no-filters', '--stdin-paths'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            cwd=cwd)
+        output = process.communicate(
+            ''.join(path + '\n' for path in paths).encode(
+                sys.getfilesystemencoding()))[0]
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode,
+                                                'git hash-object')
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return output.split()
+
+
+def fix_staged(args, standard_out, standard_error):
+    """Run fix_code() on Python files staged in git and return exit status.
+
+    Contents come from the index rather than the working tree. With
+    args.in_place, fixed contents are written back to the index, and to
+    the working tree for files that have no unstaged changes. If args.files
+    is not empty, only staged files under those paths are fixed.
+    """
+    import subprocess
+
+    try:
+        top_level = subprocess.check_output(
+            ['git', 'rev-parse', '--show-toplevel']).rstrip(b'\n').decode(
+                sys.getfilesystemencoding())
+        staged = git_staged_files(cwd=top_level)
+    except (OSError, subprocess.CalledProcessError) as exception:
+        print('Could not list staged files: {0}'.format(exception),
+              file=standard_error)
+        return 1
+
+    roots = [os.path.realpath(name) for name in args.files]
+    selected = []
+    for (path, mode, blob) in staged:
+        name = path.decode(sys.getfilesystemencoding())
+        real_name = os.path.join(os.path.realpath(top_level), name)
+        if roots and not any(real_name == root or
+                             real_name.startswith(root.rstrip(os.sep) +
+                                                  os.sep)
+                             for root in roots):
+            continue
+
+        parts = name.split('/')
+        if not all(match_name('/'.join(parts[:end]), args.exclude)
+                   for end in range(1, len(parts) + 1)):
+            continue
+
+        selected.append((os.path.relpath(real_name), path, mode, blob))
+
+    failure = False
+    updates = []
+    try:
+        blobs = git_blobs([blob for (_, _, _, blob) in selected],
+                          cwd=top_level)
+        for ((filename, path, mode, _), data) in zip(selected, blobs):
+            encoding = _detect_encoding(io.BytesIO(data).readline)
+            try:
+                source = data.decode(encoding)
+            except (LookupError, UnicodeDecodeError):
+                encoding = 'latin-1'
+                source = data.decode(encoding)
+
+            if not filename.endswith('.py') and not PYTHON_SHEBANG_REGEX.match(
+                    source.split('\n', 1)[0].rstrip('\r')):
+                continue
+
+            fixed = []
+            try:
+                fix_source(source, filename, args, standard_out,
+                           fixed.append)
+            except FileTimeoutError as exception:
+                print('{0}: {1}'.format(filename, exception),
+                      file=standard_error)
+                failure = True
+                continue
+
+            if fixed:
+                updates.append((filename, path, mode, data, fixed[0],
+                                encoding))
+
+        new_blobs = git_write_blobs(
+            [text.encode(encoding)
+             for (_, _, _, _, text, encoding) in updates],
+            cwd=top_level)
+        if len(new_blobs) != len(updates):
+            raise ValueError('git wrote {0} objects instead of {1}'.format(
+                len(new_blobs), len(updates)))
+        index_info = [mode + b' ' + blob + b'\t' + path + b'\0'
+                      for ((_, path, mode, _, _, _), blob)
+                      in zip(updates, new_blobs)]
+
+        if index_info:
+            process = subprocess.Popen(
+                ['git', 'update-index', '-z', '--index-info'],
+                stdin=subprocess.PIPE,
+                cwd=top_level)
+            process.communicate(b''.join(index_info))
+            if process.returncode:
+                raise subprocess.CalledProcessError(process.returncode,
+                                                    'git update-index')
+    except (OSError, ValueError, subprocess.CalledProcessError) as exception:
+        print('Could not update staged files: {0}'.format(exception),
+              file=standard_error)
+        return 1
+
+    for (filename, _, _, original, text, encoding) in updates:
+        try:
+            with open(filename, 'rb') as input_file:
+                if input_file.read() != original:
+                    # Keep unstaged changes.
+                    continue
+            write_file_atomically(filename, text,
+                                  encoding=encoding,
+                                  fsync=args.fsync == 'file')
+        except (IOError, OSError) as exception:
+            print('{0}: {1}'.format(filename, exception),
+                  file=standard_error)
+            failure = True
+
+    if updates and args.fsync == 'batch':
+        sync_file_systems()
+
+    return 1 if failure else 0
+
+
+def read_message(stream):
+    """Return next JSON-RPC message read from binary stream, or None at end.
+
+    Messages are framed with a Content-Length header as in the Language
+    Server Protocol. Raise ValueError if the message is malformed.
+    """
+    length = None
+    while True:
+        line = stream.readline()
+        if not line:
+            return None
+        line = line.rstrip(b'\r\n')
+        if not line:
+            break
+        (name, _, value) = line.partition(b':')
+        if name.strip().lower() == b'content-length':
+            length = int(value)
+
+    if length is None:
+        raise ValueError('missing Content-Length header')
+
+    return json.loads(stream.read(length).decode('utf-8'))
+
+
+def write_message(stream, message):
+    """Write JSON-RPC message to binary stream."""
+    body = json.dumps(message, sort_keys=True).encode('utf-8')
+    stream.write('Content-Length: {0}\r\n\r\n'.format(
+        len(body)).encode('ascii'))
+    stream.write(body)
+    stream.flush()
+
+
+def split_lines(text):
+    """Return lines of text with their line endings.
+
+    Unlike str.splitlines(), only line feeds, carriage returns, and both
+    together end lines, as in the Language Server Protocol.
+    """
+    return LINE_REGEX.findall(text)
+
+
+def position_offset(text, position):
+    """Return index into text of a Language Server Protocol position.
+
+    Positions count characters in UTF-16 code units. Positions past the
+    end of a line or of the text are clamped.
+    """
+    lines = split_lines(text)
+    line_number = position['line']
+    if line_number >= len(lines):
+        return len(text)
+
+    offset = sum(len(line) for line in lines[:line_number])
+    line = lines[line_number].rstrip('\r\n')
+    units = 0
+    for (index, character) in enumerate(line):
+        if units >= position['character']:
+            return offset + index
+        units += 2 if ord(character) > 0xFFFF else 1
+    return offset + len(line)
+
+
+def apply_change(text, change):
+    """Return text with a textDocument/didChange content change applied."""
+    if 'range' not in change:
+        return change['text']
+
+    start = position_offset(text, change['range']['start'])
+    end = position_offset(text, change['range']['end'])
+    return text[:start] + change['text'] + text[end:]
+
+
+def text_edits(old, new):
+    """Return Language Server Protocol edits that turn old into new.
+
+    Each edit replaces whole lines.
+    """
+    old_lines = split_lines(old)
+    new_lines = split_lines(new)
+    edits = []
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines,
+                                      autojunk=False)
+    for (tag, i1, i2, j1, j2) in matcher.get_opcodes():
+        if tag != 'equal':
+            edits.append({
+                'range': {'start': {'line': i1, 'character': 0},
+                          'end': {'line': i2, 'character': 0}},
+                'newText': ''.join(new_lines[j1:j2])})
+    return edits
+
+
+class LanguageServer(object):
+    """Language Server Protocol server offering fix_code() results.
+
+    Open documents are kept in memory and updated incrementally. Fixes are
+    offered as code actions and as document formatting. The result for each
+    document is cached until its version changes.
+    """
+
+    code_action_kind = 'source.fixAll.autoflake'
+
+    def __init__(self, options):
+        """Initialize server that calls fix_code() with options."""
+        self.options = options
+        self.documents = {}
+        self._edits = {}
+        self._shutdown = False
+        self._handlers = {
+            'initialize': self.initialize,
+            'shutdown': self.shutdown,
+            'textDocument/didOpen': self.did_open,
+            'textDocument/didChange': self.did_change,
+            'textDocument/didClose': self.did_close,
+            'textDocument/codeAction': self.code_action,
+            'textDocument/formatting': self.formatting,
+        }
+
+    def serve(self, input_stream, output_stream):
+        """Handle messages until exit and return exit status."""
+        while True:
+            try:
+                message = read_message(input_stream)
+            except ValueError as exception:
+                write_message(output_stream, {
+                    'jsonrpc': '2.0',
+                    'id': None,
+                    'error': {'code': -32700, 'message': str(exception)}})
+                continue
+
+            if message is None or message.get('method') == 'exit':
+                return 0 if self._shutdown else 1
+
+            response = self.handle(message)
+            if response is not None:
+                write_message(output_stream, response)
+
+    def handle(self, message):
+        """Return response to message, or None for notifications."""
+        handler = self._handlers.get(message.get('method'))
+        is_request = 'id' in message
+        if handler is None:
+            if not is_request:
+                return None
+            error = {'code': -32601,
+                     'message': 'unknown method {0}'.format(
+                         message.get('method'))}
+        else:
+            try:
+                result = handler(message.get('params') or {})
+            except Exception as exception:
+                error = {'code': -32603, 'message': str(exception)}
+            else:
+                if not is_request:
+                    return None
+                return {'jsonrpc': '2.0', 'id': message['id'],
+                        'result': result}
+
+        if not is_request:
+            return None
+        return {'jsonrpc': '2.0', 'id': message['id'], 'error': error}
+
+    def initialize(self, params):
+        """Return server capabilities."""
+        return {
+            'capabilities': {
+                'textDocumentSync': {'openClose': True, 'change': 2},
+                'codeActionProvider': {
+                    'codeActionKinds': [self.code_action_kind]},
+                'documentFormattingProvider': True,
+            },
+            'serverInfo': {'name': 'autoflake', 'version': __version__},
+        }
+
+    def shutdown(self, params):
+        """Prepare to exit."""
+        self._shutdown = True
+
+    def did_open(self, params):
+        """Start tracking a document."""
+        document = params['textDocument']
+        self.documents[document['uri']] = (document.get('version'),
+                                           document['text'])
+
+    def did_change(self, params):
+        """Apply changes to a tracked document."""
+        document = params['textDocument']
+        (_, text) = self.documents[document['uri']]
+        for change in params['contentChanges']:
+            text = apply_change(text, change)
+        self.documents[document['uri']] = (document.get('version'), text)
+
+    def did_close(self, params):
+        """Stop tracking a document."""
+        uri = params['textDocument']['uri']
+        self.documents.pop(uri, None)
+        self._edits.pop(uri, None)
+
+    def edits(self, uri):
+        """Return edits fixing document, computed once per version."""
+        (version, text) = self.documents[uri]
+        cached = self._edits.get(uri)
+        if cached and cached[0] == version and version is not None:
+            return cached[1]
+
+        edits = text_edits(text, fix_code(text, **self.options))
+        self._edits[uri] = (version, edits)
+        return edits
+
+    def code_action(self, params):
+        """Return action fixing the whole document, if it needs fixing."""
+        only = params.get('context', {}).get('only')
+        if only and not any(
+                (self.code_action_kind + '.').startswith(kind + '.')
+                for kind in only):
+            return []
+
+        uri = params['textDocument']['uri']
+        edits = self.edits(uri)
+        if not edits:
+            return []
+
+        return [{'title': 'Remove unused imports and variables',
+                 'kind': self.code_action_kind,
+                 'edit': {'changes': {uri: edits}}}]
+
+    def formatting(self, params):
+        """Return edits fixing the document."""
+        return self.edits(params['textDocument']['uri'])
+
+
+def expand_flag_files(arguments):
+    """Return arguments with each "@path" replaced by the lines of path.
+
+    Build systems pass long argument lists in such flag files. A leading
+    "@@" stands for a literal "@".
+    """
+    expanded = []
+    for argument in arguments:
+        if argument.startswith('@@'):
+            expanded.append(argument[1:])
+        elif argument.startswith('@'):
+            with io.open(argument[1:], encoding='utf-8') as flag_file:
+                expanded.extend(line.rstrip('\r\n')
+                                for line in flag_file
+                                if line.rstrip('\r\n'))
+        else:
+            expanded.append(argument)
+    return expanded
+
+
+def run_work_request(request, startup_arguments):
+    """Return WorkResponse for a build system WorkRequest.
+
+    The request's arguments are handled by _main() as if they followed
+    startup_arguments on the command line. Everything printed, including
+    argument errors, becomes the response's output.
+    """
+    output = io.StringIO()
+    (standard_out, standard_error) = (sys.stdout, sys.stderr)
+    # Keep stray prints, such as --help, off the protocol stream.
+    (sys.stdout, sys.stderr) = (output, output)
+    try:
+        status = _main(
+            ['autoflake'] + startup_arguments +
+            expand_flag_files(request.get('arguments', [])),
+            standard_out=output,
+            standard_error=output)
+    except SystemExit as exception:
+        status = exception.code
+    except IOError as exception:
+        print(exception, file=output)
+        status = 1
+    finally:
+        (sys.stdout, sys.stderr) = (standard_out, standard_error)
+
+    if status is None:
+        status = 0
+    elif not isinstance(status, int):
+        print(status, file=output)
+        status = 1
+
+    return {'exitCode': status,
+            'output': output.getvalue(),
+            'requestId': request.get('requestId', 0)}
+
+
+def serve_persistent_worker(startup_arguments, input_stream, output_stream):
+    """Answer build system work requests until input ends.
+
+    Requests and responses are JSON objects as in Bazel's JSON worker
+    protocol, one per line. The interpreter, pyflakes, and the check cache
+    stay loaded between requests. Requests are handled in the order they
+    arrive. A line that is not a request is answered with an error.
+    """
+    for line in iter(input_stream.readline, ''):
+        if not line.strip():
+            continue
+
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError('expected a JSON object')
+        except ValueError as exception:
+            response = {'exitCode': 1,
+                        'output': 'autoflake: invalid work request: '
+                                  '{0}\n'.format(exception),
+                        'requestId': 0}
+        else:
+            if request.get('cancel'):
+                # Requests are answered before the next one is read, so
+                # there is nothing left to cancel.
+                continue
+            response = run_work_request(request, startup_arguments)
+
+        output_stream.write(json.dumps(response, sort_keys=True) + '\n')
+        output_stream.flush()
+
+    return 0
+
+
+def file_signature(filename):
+    """Return value that changes when filename is modified, or None."""
+    try:
+        status = os.stat(filename)
+    except OSError:
+        return None
+    return (status.st_ino, status.st_size, status.st_mtime)
+
+
+class Watcher(object):
+    """Report Python files under filenames that change.
+
+    Subclasses implement changes(timeout=None), which returns the set of
+    files changed, waiting up to timeout seconds, or indefinitely if timeout
+    is None.
+    """
+
+    def __init__(self, filenames, recursive, exclude):
+        """Initialize watcher of files that find_files() would yield."""
+        self.filenames = list(filenames)
+        self.recursive = recursive
+        self.exclude = exclude
+        self.explicit = set(os.path.normpath(name) for name in filenames
+                            if not (recursive and os.path.isdir(name)))
+
+    def scan(self, filenames):
+        """Return (files, directories) found by find_files()."""
+        directories = []
+        files = [os.path.normpath(name)
+                 for name in find_files(list(filenames), self.recursive,
+                                        self.exclude,
+                                        directories=directories)]
+        return (files, [os.path.normpath(name) for name in directories])
+
+    def close(self):
+        """Release resources."""
+
+
+class PollingWatcher(Watcher):
+    """Watcher that compares file status every interval seconds."""
+
+    name = 'polling'
+
+    def __init__(self, filenames, recursive, exclude, interval=1.0):
+        """Initialize watcher and record the current status of files."""
+        Watcher.__init__(self, filenames, recursive, exclude)
+        self.interval = interval
+        self._signatures = self._snapshot()
+
+    def _snapshot(self):
+        (files, _) = self.scan(self.filenames)
+        return dict((name, file_signature(name)) for name in files)
+
+    def changes(self, timeout=None):
+        """Return set of files changed, waiting up to timeout seconds."""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            snapshot = self._snapshot()
+            changed = set(name for (name, signature) in snapshot.items()
+                          if signature is not None and
+                          signature != self._signatures.get(name))
+            self._signatures = snapshot
+            if changed:
+                return changed
+
+            delay = self.interval
+            if deadline is not None:
+                delay = min(delay, deadline - time.time())
+                if delay <= 0:
+                    return changed
+            time.sleep(delay)
+
+
+class InotifyWatcher(Watcher):
+    """Watcher that is notified of changes by Linux inotify.
+
+    Raise OSError or AttributeError if inotify is not available.
+    """
+
+    name = 'inotify'
+
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ISDIR = 0x40000000
+
+    def __init__(self, filenames, recursive, exclude):
+        """Initialize watcher and watch every directory to be walked."""
+        import ctypes
+        import ctypes.util
+
+        Watcher.__init__(self, filenames, recursive, exclude)
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'),
+                                 use_errno=True)
+        self._mask = ctypes.c_uint32(
+            self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE)
+        self._descriptor = self._libc.inotify_init1(
+            getattr(os, 'O_CLOEXEC', 0))
+        if self._descriptor < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+        self._watches = {}
+        self._watch_all()
+
+    def _watch_all(self):
+        (_, directories) = self.scan(self.filenames)
+        for directory in directories:
+            self._watch(directory, recursive=True)
+        for name in self.explicit:
+            self._watch(os.path.dirname(name) or '.', recursive=False)
+
+    def _watch(self, directory, recursive):
+        watch = self._libc.inotify_add_watch(
+            self._descriptor,
+            directory.encode(sys.getfilesystemencoding()),
+            self._mask)
+        if watch < 0:
+            # The directory is gone or unreadable.
+            return
+        (_, was_recursive) = self._watches.get(watch, (None, False))
+        self._watches[watch] = (directory, recursive or was_recursive)
+
+    def changes(self, timeout=None):
+        """Return set of files changed, waiting up to timeout seconds."""
+        import select
+
+        if not select.select([self._descriptor], [], [], timeout)[0]:
+            return set()
+
+        data = os.read(self._descriptor, 64 * 1024)
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            (watch, mask, _, length) = struct.unpack_from('iIII', data,
+                                                          offset)
+            name = data[offset + 16:offset + 16 + length].rstrip(b'\0')
+            offset += 16 + length
+
+            if mask & self.IN_Q_OVERFLOW:
+                # Events were lost, so look at everything again.
+                self._watch_all()
+                changed.update(self.scan(self.filenames)[0])
+                continue
+
+            if mask & self.IN_IGNORED:
+                self._watches.pop(watch, None)
+                continue
+
+            if watch not in self._watches:
+                continue
+            (directory, recursive) = self._watches[watch]
+            path = os.path.normpath(os.path.join(
+                directory, name.decode(sys.getfilesystemencoding())))
+
+            if mask & self.IN_ISDIR:
+                if recursive and match_file(path, self.exclude):
+                    (files, directories) = self.scan([path])
+                    for subdirectory in directories:
+                        self._watch(subdirectory, recursive=True)
+                    changed.update(files)
+            elif mask & (self.IN_CLOSE_WRITE | self.IN_MOVED_TO):
+                if path in self.explicit or (
+                        recursive and match_file(path, self.exclude)):
+                    changed.add(path)
+        return changed
+
+    def close(self):
+        """Stop watching."""
+        os.close(self._descriptor)
+
+
+def watch(args, standard_out, standard_error, watcher, debounce=0.2):
+    """Run fix_file() on each file watcher reports changed.
+
+    Changes are gathered until none have arrived for debounce seconds.
+    Changes made by autoflake itself are ignored. Run until interrupted.
+    """
+    written = {}
+    while True:
+        changed = watcher.changes()
+        while True:
+            more = watcher.changes(debounce)
+            if not more:
+                break
+            changed |= more
+
+        for name in sorted(changed):
+            signature = file_signature(name)
+            if signature is None or written.get(name) == signature:
+                continue
+
+            for result in fix_batch([name], args):
+                standard_out.write(result.output)
+                if result.error:
+                    print(result.error, file=standard_error)
+                if args.in_place and result.changed:
+                    written[name] = file_signature(name)
+        standard_out.flush()
+
+
+def parse_shard(string):
+    """Return (index, count) parsed from "INDEX/COUNT".
+
+    INDEX is one-based.
+    """
+    import argparse
+    try:
+        (index, count) = [int(part) for part in string.split('/')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'expected INDEX/COUNT, got {0!r}'.format(string))
+
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(
+            'shard index must be between 1 and {0}'.format(count))
+
+    return (index, count)
+
+
+def shard_of(filename, count):
+    """Return zero-based shard of filename when split into count shards.
+
+    The shard only depends on the path relative to the current directory,
+    so separate machines agree on it without coordination.
+    """
+    try:
+        path = os.path.relpath(filename)
+    except ValueError:  # pragma: no cover
+        # Different drive on Windows.
+        path = filename
+    path = path.replace(os.sep, '/')
+
+    if isinstance(path, unicode):
+        path = path.encode('utf-8', 'surrogatepass')
+
+    return int(hashlib.md5(path).hexdigest(), 16) % count
+
+
 def _main(argv, standard_out, standard_error):
     """Return exit status.
 
@@ -775,6 +2761,12 @@ def _main(argv, standard_out, standard_error):
                         help='make changes to files instead of printing diffs')
     parser.add_argument('-r', '--recursive', action='store_true',
                         help='drill down directories recursively')
+    parser.add_argument('--fsync', choices=['file', 'batch', 'none'],
+                        default='none',
+                        help='with --in-place, flush each written file to '
+                             'disk, flush once at the end of the run, or '
+                             'leave it to the operating system (default: '
+                             '%(default)s)')
     parser.add_argument('--exclude', metavar='globs',
                         help='exclude file/directory names that match these '
                              'comma-separated globs')
@@ -795,12 +2787,86 @@ def _main(argv, standard_out, standard_error):
                         help='remove all duplicate keys in objects')
     parser.add_argument('--remove-unused-variables', action='store_true',
                         help='remove unused variables')
+    parser.add_argument('--diff-only', metavar='ref',
+                        help='only change lines that differ from the git '
+                             'revision ref, such as lines changed on the '
+                             'current branch')
+    parser.add_argument('--staged', action='store_true',
+                        help='fix the contents of Python files staged in '
+                             'git rather than the working tree; with '
+                             '--in-place, write the fixed contents back to '
+                             'the index, and to the working tree for files '
+                             'with no unstaged changes; files, if given, '
+                             'limit which staged files are fixed')
+    parser.add_argument('--lsp', action='store_true',
+                        help='run a Language Server Protocol server on '
+                             'standard input and output that offers the '
+                             'fixes as code actions and formatting')
+    parser.add_argument('--persistent-worker', '--persistent_worker',
+                        action='store_true',
+                        help='run as a persistent build worker that reads '
+                             'JSON work requests from standard input and '
+                             'writes JSON work responses to standard output; '
+                             'other options apply to every request')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running and fix files as they are '
+                             'modified, using inotify where available and '
+                             'polling otherwise')
+    parser.add_argument('--format', choices=['diff', 'json'],
+                        default='diff',
+                        help='print unified diffs, or one JSON object per '
+                             'changed file listing the net edit made to each '
+                             'changed line (line, rules, old and new text); '
+                             'JSON is also printed with --in-place (default: '
+                             '%(default)s)')
+    parser.add_argument('--journal', metavar='path',
+                        help='record completed files in this file and skip '
+                             'files recorded there whose contents have not '
+                             'changed since, so an interrupted run can be '
+                             'resumed; without --in-place, only files that '
+                             'need no changes are recorded')
+    parser.add_argument('--shard', metavar='INDEX/COUNT', type=parse_shard,
+                        help='split files into COUNT shards by a stable hash '
+                             'of their relative path and only process shard '
+                             'INDEX (starting at 1); useful for spreading a '
+                             'run across machines')
+    parser.add_argument('-j', '--jobs', type=int, metavar='n', default=0,
+                        help='number of parallel jobs; 0 picks serial or '
+                             'parallel execution based on the number and '
+                             'size of files (default: %(default)s)')
+    parser.add_argument('--timeout', type=float, metavar='seconds',
+                        help='skip and report files that take longer than '
+                             'this to fix; parallel jobs then run in '
+                             'processes, as threads cannot be interrupted')
+    parser.add_argument('--max-files-per-worker', type=int, metavar='n',
+                        default=0,
+                        help='replace each worker process after it has fixed '
+                             'at least this many files')
+    parser.add_argument('--max-worker-memory', type=int, metavar='MiB',
+                        default=0,
+                        help='replace a worker process once its peak memory '
+                             'use reaches this many MiB')
+    parser.add_argument('--threads', action='store_true',
+                        help='run parallel jobs in threads rather than '
+                             'processes; this is the default on free-threaded '
+                             'interpreters, while with a GIL automatic '
+                             'planning then runs serially; cannot be used '
+                             'with --timeout')
+    parser.add_argument('--progress', action='store_true',
+                        help='show progress on standard error if it is a '
+                             'terminal')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='print verbose messages')
     parser.add_argument('--version', action='version',
                         version='%(prog)s ' + __version__)
-    parser.add_argument('files', nargs='+', help='files to format')
+    parser.add_argument('files', nargs='*', help='files to format')
 
     args = parser.parse_args(argv[1:])
 
+    if not args.files and not (args.staged or args.lsp or
+                               args.persistent_worker):
+        parser.error('the following arguments are required: files')
+
     if args.remove_all_unused_imports and args.imports:
         print('Using both --remove-all and --imports is redundant',
               file=standard_error)
@@ -811,14 +2877,173 @@ def _main(argv, standard_out, standard_error):
     else:
         args.exclude = set([])
 
-    filenames = list(set(args.files))
-    failure = False
-    for name in find_files(filenames, args.recursive, args.exclude):
+    if args.jobs < 0:
+        print('--jobs must not be negative', file=standard_error)
+        return 1
+
+    if args.persistent_worker:
+        return serve_persistent_worker(
+            [argument for argument in argv[1:]
+             if argument not in ['--persistent-worker',
+                                 '--persistent_worker']],
+            sys.stdin,
+            standard_out)
+
+    if args.lsp:
+        server = LanguageServer(fix_code_options(args))
+        return server.serve(getattr(sys.stdin, 'buffer', sys.stdin),
+                            getattr(standard_out, 'buffer', standard_out))
+
+    if args.threads and args.timeout:
+        print('--timeout cannot be used with --threads', file=standard_error)
+        return 1
+
+    args.changed_lines = None
+    if args.staged:
+        if args.diff_only:
+            print('--diff-only cannot be used with --staged',
+                  file=standard_error)
+            return 1
+        return fix_staged(args, standard_out, standard_error)
+
+    if args.watch:
+        if args.diff_only:
+            print('--diff-only cannot be used with --watch',
+                  file=standard_error)
+            return 1
+        files = unique(args.files)
         try:
-            fix_file(name, args=args, standard_out=standard_out)
-        except IOError as exception:
-            print(unicode(exception), file=standard_error)
-            failure = True
+            watcher = InotifyWatcher(files, args.recursive, args.exclude)
+        except (AttributeError, OSError):
+            watcher = PollingWatcher(files, args.recursive, args.exclude)
+        if args.verbose:
+            print('autoflake: watching for changes using {0}'.format(
+                watcher.name), file=standard_error)
+        try:
+            return watch(args, standard_out, standard_error, watcher)
+        finally:
+            watcher.close()
+
+    if args.diff_only:
+        import subprocess
+        try:
+            # Pin the commit, which may be named by a ref that moves.
+            args.diff_only = git_commit(args.diff_only)
+            args.changed_lines = git_changed_lines(args.diff_only)
+        except (OSError, subprocess.CalledProcessError) as exception:
+            print('Could not get changed lines from git: {0}'.format(
+                exception), file=standard_error)
+            return 1
+
+    filenames = (
+        name
+        for name in find_files(unique(args.files),
+                               args.recursive,
+                               args.exclude)
+        if not args.shard or
+        shard_of(name, args.shard[1]) == args.shard[0] - 1)
+
+    if args.changed_lines is not None:
+        filenames = (name for name in filenames
+                     if os.path.realpath(name) in args.changed_lines)
+
+    if args.journal:
+        journal = Journal(args.journal, journal_fingerprint(args))
+        digests = {}
+
+        def unfinished(names):
+            for name in names:
+                digest = journal.digest(name)
+                if digest and journal.is_complete(name, digest):
+                    continue
+                digests[name] = digest
+                yield name
+
+        filenames = unfinished(filenames)
+    else:
+        journal = None
+
+    if args.progress and standard_error.isatty():
+        progress = Progress(standard_error)
+        filenames = _counted(filenames, progress)
+    else:
+        progress = None
+
+    if args.jobs == 1:
+        # Stream files as they are discovered.
+        (strategy, workers) = ('serial', 1)
+        if args.verbose:
+            print('autoflake: using serial execution', file=standard_error)
+    else:
+        filenames = list(filenames)
+        sizes = file_sizes(filenames)
+        (strategy, workers) = plan_execution(len(filenames),
+                                             sum(sizes.values()),
+                                             jobs=args.jobs,
+                                             threads=args.threads,
+                                             timeout=args.timeout)
+        if args.verbose:
+            print('autoflake: {0} files, {1} bytes; using {2} execution'
+                  '{3}'.format(len(filenames), sum(sizes.values()), strategy,
+                               ' with {0} workers'.format(workers)
+                               if workers > 1 else ''),
+                  file=standard_error)
+
+    if strategy != 'serial':
+        positions = dict((name, index)
+                         for (index, name) in enumerate(filenames))
+        results = (
+            (positions[result[0]], result)
+            for result in fix_files_in_parallel(
+                schedule_batches(filenames, workers, sizes=sizes),
+                args=args,
+                jobs=workers,
+                threads=strategy == 'threads',
+                max_files=args.max_files_per_worker,
+                max_memory=args.max_worker_memory * 1024 * 1024))
+    else:
+        fixed_sources = CheckCache(
+            max_entries=FIXED_SOURCE_CACHE_MAX_ENTRIES,
+            max_characters=FIXED_SOURCE_CACHE_MAX_CHARACTERS)
+        results = enumerate(
+            result
+            for name in filenames
+            for result in fix_batch([name], args,
+                                    fixed_sources=fixed_sources))
+
+    # Output follows argument order regardless of which worker finishes
+    # first.
+    writer = OrderedWriter(standard_out)
+    failure = False
+    changed = False
+    try:
+        for (index, result) in results:
+            writer.add(index, result.output)
+            changed = changed or result.changed
+            if journal and not result.error:
+                digest = digests.pop(result.filename)
+                if args.in_place and result.changed:
+                    digest = journal.digest(result.filename)
+                # Without --in-place, a file that needs changes is left as
+                # it was, and later runs must still report it.
+                if digest and (args.in_place or not result.changed):
+                    journal.record(result.filename, digest)
+            if progress:
+                progress.update(result)
+            if result.error:
+                if progress:
+                    progress.clear()
+                print(result.error, file=standard_error)
+                failure = True
+    finally:
+        writer.close()
+        if progress:
+            progress.finish()
+        if journal:
+            journal.close()
+
+    if args.in_place and args.fsync == 'batch' and changed:
+        sync_file_systems()
 
     return 1 if failure else 0
 
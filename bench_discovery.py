@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+
+"""Measure how fast autoflake discovers files in a large tree.
+
+A synthetic tree is built with a configurable depth, fan-out and number of
+files per directory. Some files are extensionless scripts with a Python
+shebang or are not Python at all, some directories are hidden or excluded,
+and some entries are symbolic links. Only discovery (find_files() with its
+match_file() and is_python_file() checks) is timed; no file is fixed.
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+import contextlib
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import autoflake
+
+
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
+
+
+EXCLUDED_DIRECTORY = 'build'
+
+timer = getattr(time, 'perf_counter', time.time)
+
+
+def build_tree(root, depth=4, fan_out=4, files_per_directory=20,
+               shebang_fraction=0.05, other_fraction=0.1,
+               ignored_fraction=0.1, symlink_fraction=0.05, seed=0):
+    """Create synthetic source tree under root.
+
+    Each directory above the given depth has fan_out subdirectories. Of the
+    files_per_directory files in each directory, shebang_fraction are
+    extensionless Python scripts and other_fraction are not Python. An
+    ignored_fraction of directories also get a hidden and an excluded
+    subdirectory, and a symlink_fraction get symbolic links to another
+    directory and file. Return number of files discovery should find.
+    """
+    generator = random.Random(seed)
+    directories = []
+    expected = 0
+
+    def fill(directory, level):
+        count = 0
+        for index in range(files_per_directory):
+            # The first file is always a module, for symbolic links to use.
+            value = generator.random() if index else 1.0
+            if value < shebang_fraction:
+                (name, text) = ('script{0}'.format(index),
+                                '#!/usr/bin/env python\nx = 1\n')
+                count += 1
+            elif value < shebang_fraction + other_fraction:
+                (name, text) = ('data{0}.txt'.format(index), 'data\n')
+            else:
+                (name, text) = ('module{0}.py'.format(index), 'x = 1\n')
+                count += 1
+            with io.open(os.path.join(directory, name), 'w') as output:
+                output.write(text)
+
+        if level < depth:
+            for index in range(fan_out):
+                subdirectory = os.path.join(directory,
+                                            'package{0}'.format(index))
+                os.mkdir(subdirectory)
+                directories.append(subdirectory)
+                count += fill(subdirectory, level + 1)
+        return count
+
+    expected += fill(root, 1)
+
+    for directory in list(directories):
+        if generator.random() < ignored_fraction:
+            for name in ['.hidden', EXCLUDED_DIRECTORY]:
+                ignored = os.path.join(directory, name)
+                os.mkdir(ignored)
+                for index in range(files_per_directory):
+                    with io.open(os.path.join(ignored,
+                                              'module{0}.py'.format(index)),
+                                 'w') as output:
+                        output.write('x = 1\n')
+
+        if hasattr(os, 'symlink') and generator.random() < symlink_fraction:
+            target = generator.choice(directories)
+            os.symlink(target, os.path.join(directory, 'linked_package'))
+            # Links to files already found are not yielded twice.
+            os.symlink(os.path.join(target, 'module0.py'),
+                       os.path.join(directory, 'linked_module.py'))
+
+    return expected
+
+
+@contextlib.contextmanager
+def counting_calls(counts):
+    """Count calls to file system functions into counts while active.
+
+    Counts are kept per function name, for the functions through which
+    discovery reaches the operating system.
+    """
+    originals = [(os, 'stat'), (os, 'lstat'), (os, 'listdir'),
+                 (io, 'open'), (builtins, 'open')]
+    if hasattr(os, 'scandir'):
+        originals.append((os, 'scandir'))
+
+    def counted(name, function):
+        def wrapper(*args, **kwargs):
+            counts[name] += 1
+            return function(*args, **kwargs)
+        return wrapper
+
+    saved = [(module, name, getattr(module, name))
+             for (module, name) in originals]
+    for (module, name, function) in saved:
+        setattr(module, name, counted(name, function))
+    try:
+        yield counts
+    finally:
+        for (module, name, function) in saved:
+            setattr(module, name, function)
+
+
+def discover(root, exclude):
+    """Return list of files find_files() yields for root."""
+    return list(autoflake.find_files([root], True, exclude))
+
+
+def measure(root, exclude, repeat):
+    """Return (files, best seconds, call counts) of discovery under root."""
+    timings = []
+    for _ in range(repeat):
+        start = timer()
+        files = discover(root, exclude)
+        timings.append(timer() - start)
+
+    counts = collections.Counter()
+    with counting_calls(counts):
+        discover(root, exclude)
+
+    return (files, min(timings), counts)
+
+
+def process_args():
+    """Return parsed command-line arguments."""
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__)
+
+    parser.add_argument('--depth', type=int, default=4,
+                        help='directory levels (default: %(default)s)')
+    parser.add_argument('--fan-out', type=int, default=4,
+                        help='subdirectories per directory '
+                             '(default: %(default)s)')
+    parser.add_argument('--files-per-directory', type=int, default=20,
+                        help='files per directory (default: %(default)s)')
+    parser.add_argument('--shebang-fraction', type=float, default=0.05,
+                        help='fraction of files that are extensionless '
+                             'Python scripts (default: %(default)s)')
+    parser.add_argument('--other-fraction', type=float, default=0.1,
+                        help='fraction of files that are not Python '
+                             '(default: %(default)s)')
+    parser.add_argument('--ignored-fraction', type=float, default=0.1,
+                        help='fraction of directories with hidden and '
+                             'excluded subdirectories (default: %(default)s)')
+    parser.add_argument('--symlink-fraction', type=float, default=0.05,
+                        help='fraction of directories with symbolic links '
+                             '(default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='time discovery this many times and keep the '
+                             'fastest (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed (default: %(default)s)')
+    parser.add_argument('--directory',
+                        help='build the tree here and keep it, or reuse it '
+                             'if it exists; by default a temporary tree is '
+                             'built and removed')
+
+    return parser.parse_args()
+
+
+def main():
+    """Run main."""
+    args = process_args()
+
+    if args.directory and os.path.exists(args.directory):
+        root = args.directory
+        expected = None
+    else:
+        root = args.directory or tempfile.mkdtemp(prefix='autoflake_tree.')
+        if args.directory:
+            os.makedirs(root)
+        start = timer()
+        expected = build_tree(
+            root,
+            depth=args.depth,
+            fan_out=args.fan_out,
+            files_per_directory=args.files_per_directory,
+            shebang_fraction=args.shebang_fraction,
+            other_fraction=args.other_fraction,
+            ignored_fraction=args.ignored_fraction,
+            symlink_fraction=args.symlink_fraction,
+            seed=args.seed)
+        print('Built tree of {0} Python files in {1:.1f}s'.format(
+            expected, timer() - start), file=sys.stderr)
+
+    try:
+        (files, seconds, counts) = measure(root, [EXCLUDED_DIRECTORY],
+                                           repeat=args.repeat)
+    finally:
+        if not args.directory:
+            shutil.rmtree(root)
+
+    print('files:       {0}'.format(len(files)))
+    print('seconds:     {0:.4f}'.format(seconds))
+    print('files/sec:   {0:.0f}'.format(len(files) / seconds
+                                        if seconds else 0))
+    for (name, count) in sorted(counts.items()):
+        print('{0:<12} {1} ({2:.2f} per file)'.format(
+            name + ':', count, count / max(len(files), 1)))
+
+    if expected is not None and len(files) != expected:
+        print('Expected {0} files'.format(expected), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main())
+    except KeyboardInterrupt:
+        sys.exit(1)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+"""Measure autoflake's memory use on large inputs against budgets.
+
+Synthetic inputs from bench_scaling are fixed phase by phase under
+tracemalloc, which reports the peak of Python allocations in each phase.
+The whole of fix_code() and the diff are also run in a fresh interpreter
+to measure peak resident set size. Peaks are divided by the size of the
+input, and the run fails if any exceeds its budget.
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import gc
+import io
+import json
+import os
+import subprocess
+import sys
+
+import autoflake
+import bench_scaling
+
+
+DEFAULT_SIZES = [10000, 50000]
+
+# Densities of problems in each kind of input.
+INPUTS = {
+    'mixed': bench_scaling.DEFAULT_DENSITIES,
+    'imports': {'import': 0.9},
+}
+
+# Bytes allocated at peak per byte of input. The highest measured is about
+# 252, for fix_code() on 10000 lines of mixed input.
+DEFAULT_BUDGET = 280
+DEFAULT_RSS_BUDGET = 300
+
+
+def source_for(kind, size):
+    """Return synthetic source of size lines for a kind of input."""
+    return bench_scaling.generate_source(size, densities=INPUTS[kind])
+
+
+def phase_peaks(source):
+    """Return list of (phase, peak bytes) allocated while fixing source.
+
+    Each peak is measured from the memory already allocated when its phase
+    starts, so inputs to the phase are not counted.
+    """
+    import tracemalloc
+
+    options = bench_scaling.OPTIONS
+    autoflake.CHECK_CACHE.clear()
+    state = {}
+
+    def check():
+        state['messages'] = autoflake.check(source)
+
+    def filter_code():
+        state['filtered'] = ''.join(autoflake.filter_code(source, **options))
+
+    def filter_useless_pass():
+        state['passless'] = ''.join(
+            autoflake.filter_useless_pass(state['filtered']))
+
+    def fix_code():
+        autoflake.CHECK_CACHE.clear()
+        state['fixed'] = autoflake.fix_code(source, **options)
+
+    def diff():
+        autoflake.get_diff_text(io.StringIO(source).readlines(),
+                                io.StringIO(state['fixed']).readlines(),
+                                'bench.py')
+
+    peaks = []
+    for (name, function) in [('check', check),
+                             ('filter_code', filter_code),
+                             ('filter_useless_pass', filter_useless_pass),
+                             ('fix_code', fix_code),
+                             ('diff', diff)]:
+        autoflake.CHECK_CACHE.clear()
+        gc.collect()
+        tracemalloc.start()
+        try:
+            (start, _) = tracemalloc.get_traced_memory()
+            function()
+            (_, peak) = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        peaks.append((name, peak - start))
+    return peaks
+
+
+def rss_peak(kind, size):
+    """Return peak resident set size added by fixing and diffing an input.
+
+    The input is fixed in a fresh interpreter so that earlier measurements
+    do not raise the peak.
+    """
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__),
+         '--rss-child', kind, str(size)])
+    return json.loads(output.decode('utf-8'))['peak']
+
+
+def memory_status(field):
+    """Return a memory size in bytes from /proc/self/status, or None."""
+    try:
+        with io.open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    return None
+
+
+def rss_child(kind, size):
+    """Fix an input and print the peak resident set size it added."""
+    source = source_for(kind, size)
+
+    # On Linux the peak reported by getrusage() survives exec(), so it may
+    # be the parent's. Reset this process's own peak and use that instead.
+    try:
+        with io.open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except IOError:
+        pass
+    if memory_status('VmHWM') is None:
+        (current, peak) = (autoflake.peak_memory, autoflake.peak_memory)
+    else:
+        (current, peak) = (lambda: memory_status('VmRSS'),
+                           lambda: memory_status('VmHWM'))
+    baseline = current()
+
+    fixed = autoflake.fix_code(source, **bench_scaling.OPTIONS)
+    autoflake.get_diff_text(io.StringIO(source).readlines(),
+                            io.StringIO(fixed).readlines(),
+                            'bench.py')
+
+    print(json.dumps({'peak': max(peak() - baseline, 0)}))
+
+
+def process_args():
+    """Return parsed command-line arguments."""
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__)
+
+    parser.add_argument('--sizes', type=lambda s: [int(n)
+                                                   for n in s.split(',')],
+                        default=DEFAULT_SIZES,
+                        help='comma-separated line counts '
+                             '(default: %(default)s)')
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET,
+                        help='fail if a phase allocates more than this many '
+                             'bytes at peak per byte of input '
+                             '(default: %(default)s)')
+    parser.add_argument('--rss-budget', type=float,
+                        default=DEFAULT_RSS_BUDGET,
+                        help='fail if fixing an input raises peak resident '
+                             'set size by more than this many bytes per '
+                             'byte of input; 0 skips the measurement '
+                             '(default: %(default)s)')
+    parser.add_argument('--rss-child', nargs=2, metavar=('KIND', 'SIZE'),
+                        help=argparse.SUPPRESS)
+
+    return parser.parse_args()
+
+
+def main():
+    """Run main."""
+    args = process_args()
+
+    if args.rss_child:
+        rss_child(args.rss_child[0], int(args.rss_child[1]))
+        return 0
+
+    failures = []
+    print('{0:<8} {1:>8} {2:<20} {3:>12} {4:>10}'.format(
+        'input', 'lines', 'phase', 'peak bytes', 'per byte'))
+    for kind in sorted(INPUTS):
+        for size in args.sizes:
+            source = source_for(kind, size)
+            input_bytes = len(source.encode('utf-8'))
+
+            peaks = phase_peaks(source)
+            budgets = [(name, peak, args.budget) for (name, peak) in peaks]
+            if args.rss_budget and autoflake.peak_memory():
+                budgets.append(('rss', rss_peak(kind, size),
+                                args.rss_budget))
+
+            for (name, peak, budget) in budgets:
+                ratio = peak / input_bytes
+                if ratio > budget:
+                    failures.append((kind, size, name))
+                print('{0:<8} {1:>8} {2:<20} {3:>12} {4:>10.1f}{5}'.format(
+                    kind, size, name, peak, ratio,
+                    '  <-- over budget' if ratio > budget else ''))
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main())
+    except KeyboardInterrupt:
+        sys.exit(1)
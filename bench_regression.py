@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+
+"""Guard against performance regressions in autoflake.
+
+"run" times a fixed suite of benchmarks (fixing, checking and diffing
+synthetic files, and discovering files in a synthetic tree) and writes the
+median, spread and samples of each, with a fingerprint of the environment,
+as JSON. "compare" checks results against a baseline and fails if any
+benchmark slowed down by more than both a relative threshold and the noise
+seen in the two measurements, or if a baseline benchmark was not measured
+at all (unless --allow-missing is given). Without a second result file,
+the current tree is measured.
+
+    python bench_regression.py run --output baseline.json
+    (change something)
+    python bench_regression.py compare baseline.json
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import autoflake
+import bench_discovery
+import bench_scaling
+
+
+ROOT_PATH = os.path.abspath(os.path.dirname(__file__))
+
+
+def suite():
+    """Return list of (name, setup) benchmarks.
+
+    setup() prepares a benchmark and returns (function, cleanup), where
+    function is what gets timed.
+    """
+    def fixing(kind, lines):
+        densities = {'mixed': bench_scaling.DEFAULT_DENSITIES,
+                     'imports': {'import': 0.9},
+                     'clean': {}}[kind]
+
+        def setup():
+            source = bench_scaling.generate_source(lines,
+                                                   densities=densities)
+
+            def function():
+                autoflake.CHECK_CACHE.clear()
+                autoflake.fix_code(source, **bench_scaling.OPTIONS)
+            return (function, None)
+        return setup
+
+    def checking():
+        source = bench_scaling.generate_source(5000)
+
+        def function():
+            autoflake.CHECK_CACHE.clear()
+            autoflake.check(source)
+        return (function, None)
+
+    def diffing():
+        source = bench_scaling.generate_source(5000)
+        old = io.StringIO(source).readlines()
+        new = io.StringIO(
+            autoflake.fix_code(source, **bench_scaling.OPTIONS)).readlines()
+
+        def function():
+            autoflake.get_diff_text(old, new, 'bench.py')
+        return (function, None)
+
+    def discovering():
+        root = tempfile.mkdtemp(prefix='autoflake_tree.')
+        bench_discovery.build_tree(root, depth=3, fan_out=4,
+                                   files_per_directory=20)
+
+        def function():
+            bench_discovery.discover(root,
+                                     [bench_discovery.EXCLUDED_DIRECTORY])
+        return (function, lambda: shutil.rmtree(root))
+
+    return [('fix_code_mixed_5k', fixing('mixed', 5000)),
+            ('fix_code_imports_5k', fixing('imports', 5000)),
+            ('fix_code_clean_5k', fixing('clean', 5000)),
+            ('check_5k', checking),
+            ('get_diff_text_5k', diffing),
+            ('find_files_tree', discovering)]
+
+
+def median(values):
+    """Return median of values."""
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
+
+
+def spread(values):
+    """Return median absolute deviation of values."""
+    center = median(values)
+    return median([abs(value - center) for value in values])
+
+
+def fingerprint():
+    """Return dictionary describing the environment results come from."""
+    try:
+        revision = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=ROOT_PATH,
+            stderr=subprocess.STDOUT).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+
+    import pyflakes
+    return {
+        'autoflake': autoflake.__version__,
+        'cpus': autoflake.available_cpus(),
+        'machine': platform.machine(),
+        'platform': platform.platform(),
+        'pyflakes': pyflakes.__version__,
+        'python': platform.python_version(),
+        'python_implementation': platform.python_implementation(),
+        'revision': revision,
+    }
+
+
+def run(repeat, names=None, output=sys.stderr):
+    """Return results of timing each benchmark repeat times."""
+    results = {}
+    for (name, setup) in suite():
+        if names and name not in names:
+            continue
+
+        (function, cleanup) = setup()
+        try:
+            # Warm up caches and lazy imports.
+            function()
+            samples = []
+            for _ in range(repeat):
+                start = bench_scaling.timer()
+                function()
+                samples.append(bench_scaling.timer() - start)
+        finally:
+            if cleanup:
+                cleanup()
+
+        results[name] = {'median': median(samples),
+                         'spread': spread(samples),
+                         'samples': samples}
+        print('{0:<24} {1:10.4f}s +- {2:.4f}s'.format(
+            name, results[name]['median'], results[name]['spread']),
+            file=output)
+
+    return {'environment': fingerprint(), 'benchmarks': results}
+
+
+def compare(baseline, current, threshold, noise):
+    """Return list of (name, baseline, current, verdict) for benchmarks.
+
+    A benchmark regressed if its median grew by more than threshold (a
+    fraction of the baseline median) and by more than noise times the sum
+    of the two spreads.
+    """
+    rows = []
+    for (name, before) in sorted(baseline['benchmarks'].items()):
+        after = current['benchmarks'].get(name)
+        if after is None:
+            rows.append((name, before['median'], None, 'missing'))
+            continue
+
+        change = after['median'] - before['median']
+        limit = max(threshold * before['median'],
+                    noise * (before['spread'] + after['spread']))
+        if change > limit:
+            verdict = 'slower'
+        elif -change > limit:
+            verdict = 'faster'
+        else:
+            verdict = 'same'
+        rows.append((name, before['median'], after['median'], verdict))
+    return rows
+
+
+def load(filename):
+    """Return results read from filename."""
+    with io.open(filename, encoding='utf-8') as input_file:
+        return json.load(input_file)
+
+
+def process_args():
+    """Return parsed command-line arguments."""
+    import argparse
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command')
+
+    run_parser = subparsers.add_parser('run',
+                                       help='time benchmarks and write '
+                                            'results')
+    compare_parser = subparsers.add_parser('compare',
+                                           help='compare results with a '
+                                                'baseline')
+
+    for subparser in [run_parser, compare_parser]:
+        subparser.add_argument('--repeat', type=int, default=11,
+                               help='timings per benchmark '
+                                    '(default: %(default)s)')
+        subparser.add_argument('--benchmark', action='append',
+                               dest='benchmarks', metavar='name',
+                               help='only run this benchmark; may be '
+                                    'repeated')
+
+    run_parser.add_argument('--output', metavar='filename',
+                            help='write results here instead of standard '
+                                 'output')
+
+    compare_parser.add_argument('baseline', help='baseline results')
+    compare_parser.add_argument('current', nargs='?',
+                                help='results to check; by default the '
+                                     'current tree is measured')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help='fraction of the baseline median a '
+                                     'benchmark may slow down by '
+                                     '(default: %(default)s)')
+    compare_parser.add_argument('--noise', type=float, default=3.0,
+                                help='number of combined spreads a slowdown '
+                                     'must also exceed (default: '
+                                     '%(default)s)')
+    compare_parser.add_argument('--allow-missing', action='store_true',
+                                help='do not fail if a baseline benchmark '
+                                     'is missing from the current results, '
+                                     'such as after it was renamed')
+
+    args = parser.parse_args()
+    if not args.command:
+        parser.error('a command is required')
+    return args
+
+
+def main():
+    """Run main."""
+    args = process_args()
+
+    if args.command == 'run':
+        results = json.dumps(run(args.repeat, names=args.benchmarks),
+                             indent=2, sort_keys=True)
+        if args.output:
+            with io.open(args.output, 'w', encoding='utf-8') as output:
+                output.write(results + '\n')
+        else:
+            print(results)
+        return 0
+
+    baseline = load(args.baseline)
+    if args.benchmarks:
+        baseline['benchmarks'] = dict(
+            (name, result)
+            for (name, result) in baseline['benchmarks'].items()
+            if name in args.benchmarks)
+    if args.current:
+        current = load(args.current)
+    else:
+        current = run(args.repeat, names=list(baseline['benchmarks']))
+
+    for (key, value) in sorted(baseline['environment'].items()):
+        if key != 'revision' and current['environment'].get(key) != value:
+            print('warning: {0} differs: {1} != {2}'.format(
+                key, value, current['environment'].get(key)),
+                file=sys.stderr)
+
+    regressed = False
+    for (name, before, after, verdict) in compare(baseline, current,
+                                                  threshold=args.threshold,
+                                                  noise=args.noise):
+        if after is None:
+            regressed = regressed or not args.allow_missing
+            print('{0:<24} {1:10.4f}s {2:>11} {3}'.format(
+                name, before, '-', verdict))
+            continue
+        regressed = regressed or verdict == 'slower'
+        print('{0:<24} {1:10.4f}s {2:10.4f}s {3:+7.1%} {4}'.format(
+            name, before, after, after / before - 1, verdict))
+
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main())
+    except KeyboardInterrupt:
+        sys.exit(1)
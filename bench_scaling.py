@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+
+"""Measure how autoflake's running time grows with the size of a file.
+
+Synthetic files are generated with controlled densities of unused imports,
+unused variables, duplicate keys and useless "pass" statements. Each phase
+of fix_code() is timed at every size, and a power law is fitted to the
+timings. A phase is flagged if it grows faster than O(n log n).
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import math
+import random
+import sys
+import time
+
+import autoflake
+
+
+DEFAULT_SIZES = [1000, 3000, 10000, 30000, 100000, 300000, 500000]
+
+DEFAULT_DENSITIES = {
+    'import': 0.1,
+    'variable': 0.1,
+    'key': 0.1,
+    'pass': 0.1,
+}
+
+DENSITY_HELP = {
+    'import': 'unused imports',
+    'variable': 'functions with an unused variable',
+    'key': 'dictionaries with a duplicate key',
+    'pass': 'functions with a useless "pass"',
+}
+
+timer = getattr(time, 'perf_counter', time.time)
+
+OPTIONS = {
+    'remove_all_unused_imports': True,
+    'remove_duplicate_keys': True,
+    'remove_unused_variables': True,
+}
+
+
+def generate_source(lines, densities=None, seed=0):
+    """Return synthetic source code of about the given number of lines.
+
+    densities maps each kind of problem ("import", "variable", "key" and
+    "pass") to the fraction of generated blocks that contain it. The rest
+    of the blocks are clean functions.
+    """
+    if densities is None:
+        densities = DEFAULT_DENSITIES
+
+    generator = random.Random(seed)
+    blocks = []
+    count = 0
+    index = 0
+    while count < lines:
+        value = generator.random()
+        if value < densities.get('import', 0):
+            block = 'from os import path as path{0}\n'.format(index)
+        else:
+            value -= densities.get('import', 0)
+            if value < densities.get('variable', 0):
+                block = ('def function{0}():\n'
+                         '    unused{0} = {0}\n'
+                         '    return {0}\n').format(index)
+            else:
+                value -= densities.get('variable', 0)
+                if value < densities.get('key', 0):
+                    block = ("mapping{0} = {{\n"
+                             "    'key': 1,\n"
+                             "    'key': 2,\n"
+                             "    'other': {0},\n"
+                             "}}\n").format(index)
+                else:
+                    value -= densities.get('key', 0)
+                    if value < densities.get('pass', 0):
+                        block = ('def function{0}():\n'
+                                 '    pass\n'
+                                 '    return {0}\n').format(index)
+                    else:
+                        block = ('def function{0}(value):\n'
+                                 '    return value + {0}\n').format(index)
+
+        blocks.append(block)
+        count += block.count('\n')
+        index += 1
+
+    return ''.join(blocks)
+
+
+def phases(source):
+    """Return list of (name, callable) timing each phase on source.
+
+    The phases are those of a single fix_code() pass, followed by the whole
+    of fix_code() and the diff of its result.
+    """
+    filtered = ''.join(autoflake.filter_code(source, **OPTIONS))
+    fixed = autoflake.fix_code(source, **OPTIONS)
+    original_lines = io.StringIO(source).readlines()
+    fixed_lines = io.StringIO(fixed).readlines()
+
+    def check():
+        autoflake.CHECK_CACHE.clear()
+        autoflake.check(source)
+
+    def filter_code():
+        autoflake.CHECK_CACHE.clear()
+        for _ in autoflake.filter_code(source, **OPTIONS):
+            pass
+
+    def filter_useless_pass():
+        for _ in autoflake.filter_useless_pass(filtered):
+            pass
+
+    def fix_code():
+        autoflake.CHECK_CACHE.clear()
+        autoflake.fix_code(source, **OPTIONS)
+
+    def get_diff_text():
+        autoflake.get_diff_text(original_lines, fixed_lines, 'bench.py')
+
+    return [('check', check),
+            ('filter_code', filter_code),
+            ('filter_useless_pass', filter_useless_pass),
+            ('fix_code', fix_code),
+            ('get_diff_text', get_diff_text)]
+
+
+def best_time(function, repeat):
+    """Return the shortest of repeat timings of function in seconds."""
+    timings = []
+    for _ in range(repeat):
+        start = timer()
+        function()
+        timings.append(timer() - start)
+    return min(timings)
+
+
+def fit_exponent(sizes, timings):
+    """Return k of the least squares fit of timings to c * size ** k."""
+    points = [(math.log(size), math.log(max(timing, 1e-9)))
+              for (size, timing) in zip(sizes, timings)]
+    mean_x = sum(x for (x, _) in points) / len(points)
+    mean_y = sum(y for (_, y) in points) / len(points)
+    variance = sum((x - mean_x) ** 2 for (x, _) in points)
+    if not variance:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for (x, y) in points) / variance
+
+
+def excess_exponent(sizes, timings):
+    """Return growth exponent of timings beyond n log n.
+
+    This is the fitted exponent of timing / (n log n). It is about zero for
+    O(n log n) phases and about one for quadratic ones.
+    """
+    return fit_exponent(sizes, [timing / (size * math.log(size))
+                                for (size, timing) in zip(sizes, timings)])
+
+
+def measure(sizes, densities, repeat, time_limit, seed=0,
+            output=sys.stderr):
+    """Return dictionary mapping phase names to lists of (size, seconds).
+
+    Sizes larger than the first at which any phase takes longer than
+    time_limit seconds are skipped.
+    """
+    results = {}
+    for size in sizes:
+        source = generate_source(size, densities=densities, seed=seed)
+        slowest = 0.0
+        for (name, function) in phases(source):
+            seconds = best_time(function, repeat)
+            results.setdefault(name, []).append((size, seconds))
+            slowest = max(slowest, seconds)
+            print('{0:>8} lines  {1:<20} {2:10.4f}s'.format(
+                size, name, seconds), file=output)
+        if time_limit and slowest > time_limit:
+            print('Skipping larger sizes after {0:.1f}s'.format(slowest),
+                  file=output)
+            break
+    return results
+
+
+def process_args():
+    """Return parsed command-line arguments."""
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__)
+
+    parser.add_argument('--sizes', type=lambda s: [int(n)
+                                                   for n in s.split(',')],
+                        default=DEFAULT_SIZES,
+                        help='comma-separated line counts '
+                             '(default: %(default)s)')
+
+    for (name, density) in sorted(DEFAULT_DENSITIES.items()):
+        parser.add_argument('--{0}-density'.format(name), type=float,
+                            default=density,
+                            help='fraction of blocks that are {0} '
+                                 '(default: %(default)s)'.format(
+                                     DENSITY_HELP[name]))
+
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='time each phase this many times and keep the '
+                             'fastest (default: %(default)s)')
+
+    parser.add_argument('--time-limit', type=float, default=60.0,
+                        metavar='seconds',
+                        help='stop growing the input once a phase takes '
+                             'longer than this (default: %(default)s)')
+
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='flag phases whose growth exponent beyond '
+                             'n log n exceeds this (default: %(default)s)')
+
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed (default: %(default)s)')
+
+    return parser.parse_args()
+
+
+def main():
+    """Run main."""
+    args = process_args()
+    densities = dict((name, getattr(args, name + '_density'))
+                     for name in DEFAULT_DENSITIES)
+
+    results = measure(args.sizes, densities, repeat=args.repeat,
+                      time_limit=args.time_limit, seed=args.seed)
+
+    print('{0:<20} {1:>8} {2:>12}'.format('phase', 'exponent',
+                                          'beyond nlogn'))
+    flagged = []
+    for (name, points) in sorted(results.items()):
+        if len(points) < 2:
+            continue
+        sizes = [size for (size, _) in points]
+        timings = [seconds for (_, seconds) in points]
+        excess = excess_exponent(sizes, timings)
+        if excess > args.tolerance:
+            flagged.append(name)
+        print('{0:<20} {1:8.2f} {2:12.2f}{3}'.format(
+            name, fit_exponent(sizes, timings), excess,
+            '  <-- superlinear' if excess > args.tolerance else ''))
+
+    return 1 if flagged else 0
+
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main())
+    except KeyboardInterrupt:
+        sys.exit(1)
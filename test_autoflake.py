@@ -7,12 +7,15 @@ from __future__ import unicode_literals
 
 import contextlib
 import io
+import json
 import os
 import re
 import shutil
+import signal
 import subprocess
 import sys
 import tempfile
+import threading
 import unittest
 
 import autoflake
@@ -671,6 +674,104 @@ def bar():
             autoflake.fix_code(code,
                                remove_unused_variables=True))
 
+    def test_fix_code_with_edits(self):
+        edits = []
+        self.assertEqual(
+            """\
+import os
+x = os
+def foo():
+    pass
+""",
+            autoflake.fix_code(
+                """\
+import os, re, sys
+x = os
+def foo():
+    y = 1
+    pass
+""",
+                remove_unused_variables=True,
+                edits=edits))
+
+        # Each line gets one net edit, however many passes changed it.
+        self.assertEqual(
+            [(1, ['unused-import', 'useless-pass'], 'import os, re, sys\n',
+              'import os\n'),
+             (4, ['unused-variable'], '    y = 1\n', '    pass\n'),
+             (5, ['useless-pass'], '    pass\n', '')],
+            [tuple(edit) for edit in edits])
+
+    def test_fix_code_with_edits_of_each_rule(self):
+        edits = []
+        autoflake.fix_code(
+            """\
+from math import *
+sin(1)
+d = {
+    'a': 1,
+    'a': 2,
+}
+print(d)
+""",
+            expand_star_imports=True,
+            remove_duplicate_keys=True,
+            edits=edits)
+
+        self.assertEqual(
+            [(1, ['star-import'], 'from math import *\n',
+              'from math import sin\n'),
+             (4, ['duplicate-key'], "    'a': 1,\n", '')],
+            [tuple(edit) for edit in edits])
+
+    def test_fix_code_with_line_numbers(self):
+        self.assertEqual(
+            """\
+import os
+x = 1
+def foo():
+    pass
+    return 1
+""",
+            autoflake.fix_code(
+                """\
+import os
+import re, sys
+x = 1
+def foo():
+    pass
+    return 1
+""",
+                line_numbers=frozenset([2])))
+
+        self.assertEqual(
+            """\
+import os
+def foo():
+    return 1
+""",
+            autoflake.fix_code(
+                """\
+import os
+def foo():
+    pass
+    return 1
+""",
+                line_numbers=frozenset([3])))
+
+    def test_filter_code_with_line_numbers(self):
+        self.assertEqual(
+            """\
+pass
+import re
+""",
+            ''.join(autoflake.filter_code(
+                """\
+import os
+import re
+""",
+                line_numbers=frozenset([1]))))
+
     def test_detect_encoding_with_bad_encoding(self):
         with temporary_file('# -*- coding: blah -*-\n') as filename:
             self.assertEqual('latin-1',
@@ -721,6 +822,37 @@ a = {
   (0,1): 3,
 }
 print(a)
+""", remove_duplicate_keys=True)))
+
+    def test_fix_code_with_duplicate_keys_in_several_dictionaries(self):
+        self.assertEqual(
+            """\
+a = {
+  'key': 2,
+  'nested': {
+    'key': 4,
+  },
+}
+b = {
+  'key': 7,
+}
+print(a, b)
+""",
+            ''.join(autoflake.fix_code("""\
+a = {
+  'key': 1,
+  'key': 2,
+  'nested': {
+    'key': 3,
+    'key': 4,
+  },
+}
+b = {
+  'key': 5,
+  'key': 6,
+  'key': 7,
+}
+print(a, b)
 """, remove_duplicate_keys=True)))
 
     def test_fix_code_with_duplicate_key_longer(self):
@@ -1102,6 +1234,50 @@ def func11():
 
         self.assertTrue(autoflake.check('import os  # ∑'))
 
+    def test_check_uses_cache(self):
+        cache = autoflake.CHECK_CACHE
+        autoflake.CHECK_CACHE = autoflake.CheckCache()
+        try:
+            first = autoflake.check('import os\n')
+            second = autoflake.check('import os\n')
+            self.assertEqual(1, autoflake.CHECK_CACHE.misses)
+            self.assertEqual(1, autoflake.CHECK_CACHE.hits)
+            self.assertEqual(first, second)
+
+            # Callers may mutate the returned list.
+            second.pop()
+            self.assertTrue(autoflake.check('import os\n'))
+        finally:
+            autoflake.CHECK_CACHE = cache
+
+    def test_check_cache_evicts_least_recently_used(self):
+        cache = autoflake.CheckCache(max_entries=2)
+        cache.put('a', (), size=1)
+        cache.put('b', (), size=1)
+        cache.get('a')
+        cache.put('c', (), size=1)
+
+        self.assertEqual(2, len(cache))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('c'))
+
+    def test_check_cache_with_character_limit(self):
+        cache = autoflake.CheckCache(max_characters=10)
+        cache.put('a', (), size=6)
+        cache.put('b', (), size=6)
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('b'))
+        self.assertEqual(6, cache.size)
+
+        cache.put('c', (), size=11)
+        self.assertIsNone(cache.get('c'))
+
+    def test_check_cache_disabled(self):
+        cache = autoflake.CheckCache(max_entries=0)
+        cache.put('a', (), size=1)
+        self.assertEqual(0, len(cache))
+
     def test_get_diff_text(self):
         # We ignore the first two lines since it differs on Python 2.6.
         self.assertEqual(
@@ -1202,6 +1378,575 @@ def func11():
         finally:
             shutil.rmtree(temp_directory)
 
+    def test_find_files_with_overlapping_arguments(self):
+        with temporary_directory() as directory:
+            sub = os.path.join(directory, 'sub')
+            os.mkdir(sub)
+            for name in [os.path.join(directory, 'a.py'),
+                         os.path.join(sub, 'b.py')]:
+                with open(name, 'w'):
+                    pass
+
+            for arguments in [[directory, sub], [sub, directory]]:
+                files = list(autoflake.find_files(arguments, True, []))
+                self.assertEqual(
+                    ['a.py', 'b.py'],
+                    sorted(os.path.basename(f) for f in files))
+
+    def test_find_files_in_sorted_order(self):
+        with temporary_directory() as directory:
+            names = ['f{}.py'.format(i) for i in range(1, 41)]
+            for name in names + [os.path.join('b', 'x.py'),
+                                 os.path.join('a', 'y.py')]:
+                path = os.path.join(directory, name)
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.mkdir(os.path.dirname(path))
+                with open(path, 'w'):
+                    pass
+
+            files = list(autoflake.find_files([directory], True, []))
+            self.assertEqual(
+                sorted(names) + [os.path.join('a', 'y.py'),
+                                 os.path.join('b', 'x.py')],
+                [os.path.relpath(f, directory) for f in files])
+
+    @unittest.skipIf(not hasattr(os, 'symlink'), 'requires symbolic links')
+    def test_find_files_with_links(self):
+        with temporary_directory() as directory:
+            directory = os.path.abspath(directory)
+            target = os.path.join(directory, 'a.py')
+            with open(target, 'w'):
+                pass
+            os.link(target, os.path.join(directory, 'hard.py'))
+            os.symlink(target, os.path.join(directory, 'soft.py'))
+
+            sub = os.path.join(directory, 'sub')
+            os.mkdir(sub)
+            with open(os.path.join(sub, 'b.py'), 'w'):
+                pass
+            os.symlink(sub, os.path.join(directory, 'linked'))
+
+            files = list(autoflake.find_files(
+                [os.path.join(directory, 'linked'), directory], True, []))
+
+            self.assertEqual(2, len(files))
+            self.assertEqual(
+                ['b.py'],
+                [os.path.basename(f) for f in files
+                 if os.path.basename(f) not in
+                 ['a.py', 'hard.py', 'soft.py']])
+
+    def test_find_files_lists_directories(self):
+        with temporary_directory() as directory:
+            sub = os.path.join(directory, 'sub')
+            os.mkdir(sub)
+            os.mkdir(os.path.join(directory, '.hidden'))
+
+            directories = []
+            list(autoflake.find_files([directory], True, [],
+                                      directories=directories))
+            self.assertEqual([directory, sub], directories)
+
+    def test_polling_watcher(self):
+        with temporary_directory() as directory:
+            source = os.path.join(directory, 'a.py')
+            with open(source, 'w') as output:
+                output.write('import os\n')
+            with open(os.path.join(directory, 'b.txt'), 'w') as output:
+                output.write('import os\n')
+
+            watcher = autoflake.PollingWatcher([directory], True, [],
+                                               interval=0.01)
+            self.assertEqual(set(), watcher.changes(0))
+
+            with open(source, 'w') as output:
+                output.write('import re\n')
+            os.utime(source, (0, 0))
+            with open(os.path.join(directory, 'b.txt'), 'w') as output:
+                output.write('import re\n')
+            added = os.path.join(directory, 'c.py')
+            with open(added, 'w'):
+                pass
+
+            self.assertEqual(
+                set([os.path.normpath(source), os.path.normpath(added)]),
+                watcher.changes(0))
+            self.assertEqual(set(), watcher.changes(0.02))
+
+    @unittest.skipIf(not sys.platform.startswith('linux'),
+                     'requires inotify')
+    def test_inotify_watcher(self):
+        with temporary_directory() as directory:
+            source = os.path.join(directory, 'a.py')
+            with open(source, 'w'):
+                pass
+            explicit = os.path.join(directory, 'other.py')
+            with open(explicit, 'w'):
+                pass
+
+            watcher = autoflake.InotifyWatcher([source], False, [])
+            try:
+                self.assertEqual(set(), watcher.changes(0))
+
+                for name in [source, explicit]:
+                    with open(name, 'w') as output:
+                        output.write('import os\n')
+                self.assertEqual(set([os.path.normpath(source)]),
+                                 watcher.changes(1))
+            finally:
+                watcher.close()
+
+            watcher = autoflake.InotifyWatcher([directory], True, ['ex'])
+            try:
+                sub = os.path.join(directory, 'sub')
+                os.mkdir(sub)
+                os.mkdir(os.path.join(directory, 'ex'))
+                with open(os.path.join(sub, 'b.py'), 'w'):
+                    pass
+                changes = set()
+                while True:
+                    more = watcher.changes(0.2)
+                    if not more:
+                        break
+                    changes |= more
+                self.assertIn(os.path.normpath(os.path.join(sub, 'b.py')),
+                              changes)
+
+                with open(os.path.join(directory, 'ex', 'c.py'), 'w'):
+                    pass
+                with open(os.path.join(sub, 'b.txt'), 'w'):
+                    pass
+                with open(os.path.join(sub, 'b.py'), 'w') as output:
+                    output.write('import os\n')
+                self.assertEqual(
+                    set([os.path.normpath(os.path.join(sub, 'b.py'))]),
+                    watcher.changes(1))
+            finally:
+                watcher.close()
+
+    def test_parse_shard(self):
+        self.assertEqual((1, 3), autoflake.parse_shard('1/3'))
+        self.assertEqual((3, 3), autoflake.parse_shard('3/3'))
+
+        import argparse
+        for string in ['0/3', '4/3', '1', '1/2/3', 'a/b']:
+            with self.assertRaises(argparse.ArgumentTypeError):
+                autoflake.parse_shard(string)
+
+    def test_shard_of(self):
+        names = ['dir/file{0}.py'.format(i) for i in range(100)]
+        shards = [autoflake.shard_of(name, 4) for name in names]
+
+        self.assertEqual(shards, [autoflake.shard_of(name, 4)
+                                  for name in names])
+        self.assertEqual({0, 1, 2, 3}, set(shards))
+        self.assertEqual(
+            autoflake.shard_of('dir/file0.py', 4),
+            autoflake.shard_of(os.path.abspath('dir/file0.py'), 4))
+
+    def test_split_lines(self):
+        self.assertEqual(['a\n', 'b\r\n', 'c\r', 'd\x0ce'],
+                         autoflake.split_lines('a\nb\r\nc\rd\x0ce'))
+        self.assertEqual([], autoflake.split_lines(''))
+
+    def test_apply_change(self):
+        text = 'import os\nx = "\U0001f600y"\n'
+        self.assertEqual(
+            'import os\nx = "\U0001f600z"\n',
+            autoflake.apply_change(text, {
+                'range': {'start': {'line': 1, 'character': 7},
+                          'end': {'line': 1, 'character': 8}},
+                'text': 'z'}))
+        self.assertEqual(
+            'import os\nimport re\nx = "\U0001f600y"\n',
+            autoflake.apply_change(text, {
+                'range': {'start': {'line': 1, 'character': 0},
+                          'end': {'line': 1, 'character': 0}},
+                'text': 'import re\n'}))
+        self.assertEqual(
+            text + 'z\n',
+            autoflake.apply_change(text, {
+                'range': {'start': {'line': 2, 'character': 0},
+                          'end': {'line': 2, 'character': 0}},
+                'text': 'z\n'}))
+        self.assertEqual('y', autoflake.apply_change(text, {'text': 'y'}))
+
+    def test_text_edits(self):
+        old = 'import os\nimport re\nx = 1\nimport sys\n'
+        new = 'import os\nx = 1\n'
+        edits = autoflake.text_edits(old, new)
+        self.assertEqual(
+            [{'range': {'start': {'line': 1, 'character': 0},
+                        'end': {'line': 2, 'character': 0}},
+              'newText': ''},
+             {'range': {'start': {'line': 3, 'character': 0},
+                        'end': {'line': 4, 'character': 0}},
+              'newText': ''}],
+            edits)
+
+        for edit in reversed(edits):
+            old = autoflake.apply_change(
+                old, {'range': edit['range'], 'text': edit['newText']})
+        self.assertEqual(new, old)
+
+    def test_language_server(self):
+        server = autoflake.LanguageServer(
+            {'remove_all_unused_imports': True})
+        uri = 'file:///example.py'
+        server.handle({'jsonrpc': '2.0', 'method': 'textDocument/didOpen',
+                       'params': {'textDocument': {
+                           'uri': uri, 'version': 1,
+                           'text': 'import os\nx = 1\n'}}})
+
+        def code_action(only=None):
+            return server.handle({
+                'jsonrpc': '2.0', 'id': 1,
+                'method': 'textDocument/codeAction',
+                'params': {'textDocument': {'uri': uri},
+                           'context': {'only': only} if only else {}}})
+
+        actions = code_action()['result']
+        self.assertEqual(1, len(actions))
+        self.assertEqual({uri: [{'range': {
+            'start': {'line': 0, 'character': 0},
+            'end': {'line': 1, 'character': 0}}, 'newText': ''}]},
+            actions[0]['edit']['changes'])
+        self.assertEqual(actions, code_action(['source'])['result'])
+        self.assertEqual([], code_action(['quickfix'])['result'])
+
+        server.handle({'jsonrpc': '2.0', 'method': 'textDocument/didChange',
+                       'params': {'textDocument': {'uri': uri, 'version': 2},
+                                  'contentChanges': [{
+                                      'range': {
+                                          'start': {'line': 1,
+                                                    'character': 0},
+                                          'end': {'line': 1,
+                                                  'character': 0}},
+                                      'text': 'print(os)\n'}]}})
+        self.assertEqual([], code_action()['result'])
+        self.assertEqual([], server.handle({
+            'jsonrpc': '2.0', 'id': 2, 'method': 'textDocument/formatting',
+            'params': {'textDocument': {'uri': uri}}})['result'])
+
+        self.assertEqual(-32601, server.handle({
+            'jsonrpc': '2.0', 'id': 3, 'method': 'unknown'})['error']['code'])
+        self.assertIsNone(server.handle({'jsonrpc': '2.0',
+                                         'method': 'unknown'}))
+
+    def test_language_server_caches_by_version(self):
+        calls = []
+        original_fix_code = autoflake.fix_code
+
+        def fix_code(source, **options):
+            calls.append(source)
+            return original_fix_code(source, **options)
+
+        server = autoflake.LanguageServer({})
+        uri = 'file:///example.py'
+        server.did_open({'textDocument': {'uri': uri, 'version': 1,
+                                          'text': 'import os\n'}})
+        autoflake.fix_code = fix_code
+        try:
+            first = server.formatting({'textDocument': {'uri': uri}})
+            self.assertEqual(first,
+                             server.formatting({'textDocument': {'uri': uri}}))
+            self.assertEqual(1, len(calls))
+
+            server.did_change({'textDocument': {'uri': uri, 'version': 2},
+                               'contentChanges': [{'text': 'import re\n'}]})
+            server.formatting({'textDocument': {'uri': uri}})
+            self.assertEqual(['import os\n', 'import re\n'], calls)
+        finally:
+            autoflake.fix_code = original_fix_code
+
+    def test_schedule_batches(self):
+        with temporary_directory() as directory:
+            sizes = {'huge.py': 100000, 'big.py': 50000}
+            for index in range(40):
+                sizes['small{0}.py'.format(index)] = 10
+
+            for (name, size) in sizes.items():
+                with open(os.path.join(directory, name), 'w') as output:
+                    output.write('#' * size)
+
+            batches = autoflake.schedule_batches(
+                [os.path.join(directory, name) for name in sizes],
+                jobs=2)
+
+            self.assertEqual(
+                [['huge.py'], ['big.py']],
+                [[os.path.basename(name) for name in batch]
+                 for batch in batches[:2]])
+
+            small_batches = batches[2:]
+            self.assertGreater(len(small_batches), 1)
+            self.assertLess(len(small_batches), 40)
+            self.assertEqual(
+                42, sum(len(batch) for batch in batches))
+
+    def test_schedule_batches_with_missing_file(self):
+        self.assertEqual([['nonexistent_file']],
+                         autoflake.schedule_batches(['nonexistent_file'],
+                                                    jobs=4))
+
+    def test_plan_execution(self):
+        big = 100 * autoflake.PARALLEL_MIN_BYTES
+        expected_parallel = ('processes' if autoflake.gil_enabled()
+                             else 'threads')
+
+        self.assertEqual(('serial', 1),
+                         autoflake.plan_execution(3, 3000, cpus=8))
+        self.assertEqual(('serial', 1),
+                         autoflake.plan_execution(1000, big, cpus=1))
+        self.assertEqual(('serial', 1),
+                         autoflake.plan_execution(1, big, cpus=8))
+        self.assertEqual((expected_parallel, 8),
+                         autoflake.plan_execution(1000, big, cpus=8))
+        self.assertEqual((expected_parallel, 2),
+                         autoflake.plan_execution(2, big, cpus=8))
+
+        self.assertEqual(('serial', 1),
+                         autoflake.plan_execution(1000, big, jobs=1))
+        self.assertEqual((expected_parallel, 3),
+                         autoflake.plan_execution(10, 10, jobs=3, cpus=1))
+
+    def test_plan_execution_with_threads(self):
+        big = 100 * autoflake.PARALLEL_MIN_BYTES
+
+        self.assertEqual(('threads', 4),
+                         autoflake.plan_execution(10, 10, jobs=4,
+                                                  threads=True))
+
+        if autoflake.gil_enabled():
+            self.assertEqual(('serial', 1),
+                             autoflake.plan_execution(1000, big, cpus=8,
+                                                      threads=True))
+        else:
+            self.assertEqual(('threads', 8),
+                             autoflake.plan_execution(1000, big, cpus=8,
+                                                      threads=True))
+
+        # Threads cannot be interrupted by a timeout.
+        self.assertEqual(('processes', 8),
+                         autoflake.plan_execution(1000, big, cpus=8,
+                                                  timeout=1.0))
+
+    def test_timeout_with_threads(self):
+        output_file = io.StringIO()
+        with temporary_file('import os\n') as filename:
+            status = autoflake._main(
+                argv=['my_fake_program', '--threads', '--timeout=1',
+                      filename],
+                standard_out=output_file,
+                standard_error=output_file)
+        self.assertEqual(1, status)
+        self.assertIn('--timeout cannot be used with --threads',
+                      output_file.getvalue())
+
+    @unittest.skipIf(not hasattr(signal, 'setitimer'), 'requires SIGALRM')
+    def test_time_limit(self):
+        with self.assertRaises(autoflake.FileTimeoutError):
+            with autoflake.time_limit(0.01):
+                while True:
+                    pass
+
+        with autoflake.time_limit(None):
+            pass
+
+        with autoflake.time_limit(10):
+            pass
+        self.assertEqual((0.0, 0.0),
+                         signal.getitimer(signal.ITIMER_REAL))
+
+    @unittest.skipIf(not hasattr(signal, 'setitimer'), 'requires SIGALRM')
+    def test_timeout(self):
+        fix_code = autoflake.fix_code
+
+        def slow_fix_code(source, **kwargs):
+            if 'slow' in source:
+                while True:
+                    pass
+            return fix_code(source, **kwargs)
+
+        with temporary_file('import os  # slow\n') as slow_filename:
+            with temporary_file('import os\n') as filename:
+                output_file = io.StringIO()
+                error_file = io.StringIO()
+                autoflake.fix_code = slow_fix_code
+                try:
+                    status = autoflake._main(
+                        argv=['my_fake_program', '--jobs=1', '--timeout=0.1',
+                              slow_filename, filename],
+                        standard_out=output_file,
+                        standard_error=error_file)
+                finally:
+                    autoflake.fix_code = fix_code
+
+        self.assertEqual(1, status)
+        self.assertIn('-import os', output_file.getvalue())
+        self.assertIn('timed out', error_file.getvalue())
+        self.assertIn(slow_filename, error_file.getvalue())
+
+    @unittest.skipIf(not hasattr(signal, 'setitimer'), 'requires SIGALRM')
+    def test_timeout_in_pyflakes(self):
+        source = ''.join('def function{0}(value):\n'
+                         '    import os\n'
+                         '    return value + {0}\n'.format(index)
+                         for index in range(20000))
+        autoflake.CHECK_CACHE.clear()
+
+        with self.assertRaises(autoflake.FileTimeoutError):
+            with autoflake.time_limit(0.01):
+                autoflake.check(source)
+        self.assertIsNone(
+            autoflake.CHECK_CACHE.get(autoflake.source_hash(source)))
+
+        with temporary_file(source) as filename:
+            output_file = io.StringIO()
+            error_file = io.StringIO()
+            status = autoflake._main(
+                argv=['my_fake_program', '--jobs=1', '--timeout=0.01',
+                      filename],
+                standard_out=output_file,
+                standard_error=error_file)
+
+        self.assertEqual(1, status)
+        self.assertEqual('', output_file.getvalue())
+        self.assertIn('timed out', error_file.getvalue())
+        self.assertEqual(0, len(autoflake.CHECK_CACHE))
+
+    def test_fix_code_in_threads(self):
+        sources = [
+            'import os\nimport re\nx = re\n',
+            'import sys\ntry:\n    import os\nexcept ImportError:\n'
+            '    pass\n',
+            'def f():\n    x = 1\n    import abc\n',
+            'from math import *\nsin(1)\n',
+        ] * 10
+        options = {'additional_imports': ['foo'],
+                   'expand_star_imports': True,
+                   'remove_unused_variables': True}
+        expected = [autoflake.fix_code(source, **options)
+                    for source in sources]
+
+        cache = autoflake.CHECK_CACHE
+        autoflake.CHECK_CACHE = autoflake.CheckCache(max_entries=5)
+        try:
+            results = [None] * len(sources)
+
+            def fix(index):
+                results[index] = autoflake.fix_code(sources[index],
+                                                    **options)
+
+            threads = [threading.Thread(target=fix, args=(index,))
+                       for index in range(len(sources))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(expected, results)
+            self.assertEqual(
+                autoflake.CHECK_CACHE.size,
+                sum(size for (_, size)
+                    in autoflake.CHECK_CACHE._entries.values()))
+        finally:
+            autoflake.CHECK_CACHE = cache
+
+        self.assertNotIn('foo', autoflake.SAFE_IMPORTS)
+
+    def test_fix_files_in_parallel_with_threads(self):
+        import argparse
+        with temporary_file('import os\n') as filename:
+            args = argparse.Namespace(
+                imports=None,
+                expand_star_imports=False,
+                remove_all_unused_imports=False,
+                remove_duplicate_keys=False,
+                remove_unused_variables=False,
+                in_place=False,
+                format='diff',
+                timeout=None,
+                changed_lines=None)
+            import multiprocessing
+            pipe = multiprocessing.Pipe
+
+            def failing_pipe(*arguments, **options):
+                raise AssertionError('threads need no pipes')
+
+            # Threads are handed batches and results without pickling.
+            multiprocessing.Pipe = failing_pipe
+            try:
+                results = list(autoflake.fix_files_in_parallel(
+                    [[filename], [filename, 'nonexistent_file']],
+                    args=args,
+                    jobs=2,
+                    threads=True))
+            finally:
+                multiprocessing.Pipe = pipe
+
+        self.assertEqual(3, len(results))
+        self.assertEqual(
+            2, sum('-import os' in result.output for result in results))
+        self.assertEqual(
+            2, sum(result.changed for result in results))
+        self.assertEqual(
+            1, sum(result.error is not None for result in results))
+
+    def test_ordered_writer(self):
+        writes = []
+
+        class Stream(object):
+
+            def write(self, text):
+                writes.append(text)
+
+        writer = autoflake.OrderedWriter(Stream(), chunk_size=4,
+                                         max_pending=3)
+        writer.add(2, 'cc')
+        writer.add(3, '')
+        writer.add(1, 'bb∑')
+        self.assertEqual([], writes)
+
+        writer.add(0, 'a')
+        self.assertEqual(['abb∑'], writes)
+
+        writer.add(5, 'f')
+        writer.add(4, 'e')
+        writer.close()
+
+        self.assertEqual('abb∑ccef', ''.join(writes))
+        self.assertEqual(['abb∑', 'ccef'], writes)
+
+    def test_progress(self):
+        now = [100.0]
+        output_file = io.StringIO()
+        progress = autoflake.Progress(output_file, interval=1,
+                                      clock=lambda: now[0])
+
+        for _ in range(4):
+            progress.discover()
+        self.assertEqual(1, output_file.getvalue().count('\r'))
+
+        now[0] += 2
+        progress.update(autoflake.FileResult('a.py', '', None, True, 100))
+        self.assertIn('1/4 files, 1 changed, 0 files/s, 50 lines/s, ETA 6s',
+                      output_file.getvalue())
+
+        progress.update(autoflake.FileResult('b.py', '', None, False, 10))
+        self.assertNotIn('2/4', output_file.getvalue())
+
+        progress.clear()
+        self.assertTrue(output_file.getvalue().endswith('\r\x1b[K'))
+
+        progress.finish()
+        self.assertTrue(output_file.getvalue().endswith('\n'))
+        self.assertIn('2/4 files, 1 changed', output_file.getvalue())
+
+    def test_unique(self):
+        self.assertEqual(['b', 'a', 'c'],
+                         autoflake.unique(['b', 'a', 'b', 'c', 'a']))
+
     def test_exclude(self):
         temp_directory = tempfile.mkdtemp(dir='.')
         try:
@@ -1302,6 +2047,97 @@ except ImportError:
     pass
 """, f.read())
 
+    def test_json_format(self):
+        with temporary_file("""\
+import re
+import os
+x = 1
+""") as filename:
+            output_file = io.StringIO()
+            autoflake._main(argv=['my_fake_program', '--format=json',
+                                  filename],
+                            standard_out=output_file,
+                            standard_error=None)
+
+        self.assertEqual(
+            {'filename': filename,
+             'edits': [
+                 {'line': 1, 'rules': ['unused-import', 'useless-pass'],
+                  'old': 'import re\n', 'new': ''},
+                 {'line': 2, 'rules': ['unused-import', 'useless-pass'],
+                  'old': 'import os\n', 'new': ''}]},
+            json.loads(output_file.getvalue()))
+
+    def test_in_place_keeps_mode_and_leaves_no_temporary_files(self):
+        with temporary_directory() as directory:
+            filename = os.path.join(directory, 'a.py')
+            with open(filename, 'w') as output:
+                output.write('import os\n')
+            os.chmod(filename, 0o751)
+
+            autoflake._main(argv=['my_fake_program', '--in-place',
+                                  '--fsync=file', filename],
+                            standard_out=None,
+                            standard_error=None)
+
+            with open(filename) as f:
+                self.assertEqual('', f.read())
+            self.assertEqual(0o751, os.stat(filename).st_mode & 0o777)
+            self.assertEqual(['a.py'], os.listdir(directory))
+
+    @unittest.skipIf(not hasattr(os, 'symlink'), 'requires symbolic links')
+    def test_in_place_with_symbolic_link(self):
+        with temporary_directory() as directory:
+            directory = os.path.abspath(directory)
+            target = os.path.join(directory, 'target.py')
+            with open(target, 'w') as output:
+                output.write('import os\nx = 1\n')
+            link = os.path.join(directory, 'link.py')
+            os.symlink(target, link)
+
+            autoflake._main(argv=['my_fake_program', '--in-place', link],
+                            standard_out=None,
+                            standard_error=None)
+
+            self.assertTrue(os.path.islink(link))
+            with open(target) as f:
+                self.assertEqual('x = 1\n', f.read())
+
+    @unittest.skipIf(not hasattr(os, 'link'), 'requires hard links')
+    def test_in_place_with_hard_link(self):
+        with temporary_directory() as directory:
+            first = os.path.join(directory, 'a.py')
+            with open(first, 'w') as output:
+                output.write('import os\nx = 1\n')
+            second = os.path.join(directory, 'b.py')
+            os.link(first, second)
+
+            autoflake._main(argv=['my_fake_program', '--in-place',
+                                  '--recursive', directory],
+                            standard_out=None,
+                            standard_error=None)
+
+            for filename in [first, second]:
+                with open(filename) as f:
+                    self.assertEqual('x = 1\n', f.read())
+            self.assertTrue(os.path.samefile(first, second))
+            self.assertEqual(['a.py', 'b.py'], sorted(os.listdir(directory)))
+
+    def test_in_place_with_batched_fsync(self):
+        sync_file_systems = autoflake.sync_file_systems
+        calls = []
+        autoflake.sync_file_systems = lambda: calls.append(True)
+        try:
+            with temporary_file('import os\n') as filename:
+                autoflake._main(argv=['my_fake_program', '--in-place',
+                                      '--fsync=batch', filename, filename],
+                                standard_out=None,
+                                standard_error=None)
+        finally:
+            autoflake.sync_file_systems = sync_file_systems
+
+        self.assertEqual([True], calls)
+
     def test_in_place_with_empty_file(self):
         line = ''
 
@@ -1344,6 +2180,605 @@ except ImportError:
     pass
 """, f.read())
 
+    def test_identical_files_are_fixed_once(self):
+        fix_code = autoflake.fix_code
+        calls = []
+
+        def counting_fix_code(source, **kwargs):
+            calls.append(source)
+            return fix_code(source, **kwargs)
+
+        with temporary_directory() as directory:
+            for name in ['a.py', 'b.py']:
+                with open(os.path.join(directory, name), 'w') as output:
+                    output.write('import os\nimport re\nx = re\n')
+
+            output_file = io.StringIO()
+            autoflake.fix_code = counting_fix_code
+            try:
+                autoflake._main(argv=['my_fake_program', '--recursive',
+                                      directory],
+                                standard_out=output_file,
+                                standard_error=None)
+            finally:
+                autoflake.fix_code = fix_code
+
+            self.assertEqual(1, len(calls))
+            self.assertEqual(2, output_file.getvalue().count('-import os'))
+            self.assertIn('a.py', output_file.getvalue())
+            self.assertIn('b.py', output_file.getvalue())
+
+    def test_fixed_sources_are_bounded(self):
+        import argparse
+        args = argparse.Namespace(
+            imports=None,
+            expand_star_imports=False,
+            remove_all_unused_imports=False,
+            remove_duplicate_keys=False,
+            remove_unused_variables=False,
+            in_place=False,
+            format='diff',
+            timeout=None,
+            changed_lines=None)
+        fixed_sources = autoflake.CheckCache(max_entries=3, max_characters=40)
+
+        for index in range(10):
+            source = 'import os\nx = {0}\n'.format(index)
+            autoflake.fix_source(source, 'a.py', args, io.StringIO(),
+                                 write=None, fixed_sources=fixed_sources)
+            self.assertLessEqual(fixed_sources.size, 40)
+        self.assertEqual(3, len(fixed_sources))
+
+        # Only the text of changed sources counts towards the size.
+        fixed_sources.clear()
+        autoflake.fix_source('x = 1\n', 'a.py', args, io.StringIO(),
+                             write=None, fixed_sources=fixed_sources)
+        self.assertEqual((1, 0), (len(fixed_sources), fixed_sources.size))
+
+        output = io.StringIO()
+        self.assertEqual(
+            (True, 2),
+            autoflake.fix_source('import os\nx = 9\n', 'a.py', args,
+                                 output, write=None,
+                                 fixed_sources=fixed_sources))
+        self.assertIn('-import os', output.getvalue())
+
+    def test_shard(self):
+        with temporary_directory() as directory:
+            for index in range(20):
+                name = os.path.join(directory, 'f{0}.py'.format(index))
+                with open(name, 'w') as output:
+                    output.write('import os\n')
+
+            outputs = []
+            for index in range(1, 4):
+                output_file = io.StringIO()
+                autoflake._main(argv=['my_fake_program', '--recursive',
+                                      '--shard={0}/3'.format(index),
+                                      directory],
+                                standard_out=output_file,
+                                standard_error=None)
+                outputs.append(re.findall(r'^\+\+\+ fixed/(.*)$',
+                                          output_file.getvalue(),
+                                          flags=re.MULTILINE))
+
+            names = [name for output in outputs for name in output]
+            self.assertEqual(20, len(names))
+            self.assertEqual(20, len(set(names)))
+
+    def test_jobs(self):
+        with temporary_directory() as directory:
+            for index in range(10):
+                name = os.path.join(directory, 'f{0}.py'.format(index))
+                with open(name, 'w') as output:
+                    output.write('import os\n' * (index + 1) + 'x = 1\n')
+
+            outputs = []
+            for jobs in ['1', '3']:
+                output_file = io.StringIO()
+                status = autoflake._main(
+                    argv=['my_fake_program', '--recursive',
+                          '--jobs=' + jobs, directory],
+                    standard_out=output_file,
+                    standard_error=None)
+                self.assertEqual(0, status)
+                outputs.append(output_file.getvalue())
+
+            self.assertEqual(10, outputs[0].count('+++ fixed/'))
+            self.assertEqual(outputs[0], outputs[1])
+
+    def test_verbose(self):
+        with temporary_file('import os\n') as filename:
+            output_file = io.StringIO()
+            error_file = io.StringIO()
+            autoflake._main(argv=['my_fake_program', '--verbose', filename],
+                            standard_out=output_file,
+                            standard_error=error_file)
+        self.assertIn('-import os', output_file.getvalue())
+        self.assertIn('1 files', error_file.getvalue())
+        self.assertIn('serial', error_file.getvalue())
+
+    def test_jobs_with_worker_recycling(self):
+        with temporary_directory() as directory:
+            for index in range(10):
+                name = os.path.join(directory, 'f{0}.py'.format(index))
+                with open(name, 'w') as output:
+                    output.write('import os\n' * (index + 1) + 'x = 1\n')
+
+            output_file = io.StringIO()
+            status = autoflake._main(
+                argv=['my_fake_program', '--recursive', '--jobs=2',
+                      '--max-files-per-worker=1', '--max-worker-memory=1',
+                      directory],
+                standard_out=output_file,
+                standard_error=None)
+
+        self.assertEqual(0, status)
+        self.assertEqual(10, output_file.getvalue().count('+++ fixed/'))
+
+    def test_jobs_with_killed_worker(self):
+        import argparse
+        import multiprocessing
+        args = argparse.Namespace(
+            imports=None,
+            expand_star_imports=False,
+            remove_all_unused_imports=False,
+            remove_duplicate_keys=False,
+            remove_unused_variables=False,
+            in_place=False,
+            format='diff',
+            timeout=None,
+            changed_lines=None)
+        with temporary_directory() as directory:
+            batches = []
+            for index in range(6):
+                name = os.path.join(directory, 'f{0}.py'.format(index))
+                with open(name, 'w') as output:
+                    output.write('import os\n' + 'x = 1\n' * 5000)
+                batches.append([name])
+
+            results = []
+            with autoflake.time_limit(120):
+                for result in autoflake.fix_files_in_parallel(
+                        batches, args=args, jobs=2):
+                    if not results:
+                        # Both workers are busy with a batch now.
+                        for worker in multiprocessing.active_children():
+                            os.kill(worker.pid, signal.SIGKILL)
+                    results.append(result)
+
+        self.assertEqual(6, len(results))
+        errors = [result.error for result in results if result.error]
+        self.assertTrue(errors)
+        for error in errors:
+            self.assertIn('worker exited unexpectedly', error)
+        self.assertEqual(6 - len(errors),
+                         sum(result.changed for result in results))
+
+    def test_progress_without_terminal(self):
+        with temporary_file('import os\n') as filename:
+            output_file = io.StringIO()
+            error_file = io.StringIO()
+            autoflake._main(argv=['my_fake_program', '--progress', filename],
+                            standard_out=output_file,
+                            standard_error=error_file)
+        self.assertIn('-import os', output_file.getvalue())
+        self.assertEqual('', error_file.getvalue())
+
+    def test_jobs_with_missing_file(self):
+        output_file = io.StringIO()
+        with temporary_file('import os\n') as filename:
+            status = autoflake._main(
+                argv=['my_fake_program', '--jobs=2',
+                      filename, 'nonexistent_file'],
+                standard_out=output_file,
+                standard_error=output_file)
+        self.assertEqual(1, status)
+        self.assertIn('-import os', output_file.getvalue())
+        self.assertIn('no such file', output_file.getvalue().lower())
+
+    def test_journal(self):
+        fix_code = autoflake.fix_code
+        calls = []
+
+        def counting_fix_code(source, **kwargs):
+            calls.append(source)
+            return fix_code(source, **kwargs)
+
+        with temporary_directory() as directory:
+            journal = os.path.join(directory, 'journal')
+            first = os.path.join(directory, 'first.py')
+            second = os.path.join(directory, 'second.py')
+            for (name, variable) in [(first, 'x'), (second, 'y')]:
+                with open(name, 'w') as output:
+                    output.write('import os\n' + variable + ' = 1\n')
+
+            def run(*options):
+                del calls[:]
+                autoflake.fix_code = counting_fix_code
+                try:
+                    self.assertEqual(0, autoflake._main(
+                        argv=['my_fake_program', '--journal', journal] +
+                        list(options) + [first, second],
+                        standard_out=io.StringIO(),
+                        standard_error=None))
+                finally:
+                    autoflake.fix_code = fix_code
+                return len(calls)
+
+            self.assertEqual(2, run('--in-place'))
+            with open(first) as f:
+                self.assertEqual('x = 1\n', f.read())
+            self.assertEqual(0, run('--in-place'))
+
+            with open(second, 'a') as output:
+                output.write('import re\n')
+            self.assertEqual(1, run('--in-place'))
+
+            # Results depend on options, so they are not reused.
+            self.assertEqual(2, run())
+            self.assertEqual(0, run())
+
+            # Without --in-place, files that still need changes are not
+            # recorded, so their diffs are printed again.
+            with open(first, 'a') as output:
+                output.write('import re\n')
+            self.assertEqual(1, run())
+            self.assertEqual(1, run())
+
+    def test_journal_compaction(self):
+        with temporary_directory() as directory:
+            path = os.path.join(directory, 'journal')
+            journal = autoflake.Journal(path, fingerprint='')
+            journal.compact_min_lines = 10
+            for index in range(100):
+                journal.record('file{0}.py'.format(index % 3),
+                               'digest{0}'.format(index))
+            journal.close()
+
+            with open(path) as journal_file:
+                lines = journal_file.readlines()
+            self.assertLess(len(lines), 30)
+
+            # Partial lines from an interrupted run are ignored.
+            with open(path, 'a') as journal_file:
+                journal_file.write('digest')
+
+            journal = autoflake.Journal(path, fingerprint='')
+            self.assertTrue(journal.is_complete('file0.py', 'digest99'))
+            self.assertTrue(journal.is_complete('file1.py', 'digest97'))
+            self.assertTrue(journal.is_complete('file2.py', 'digest98'))
+            self.assertFalse(journal.is_complete('file2.py', 'digest95'))
+            journal.close()
+
+    def test_diff_only(self):
+        with temporary_directory() as directory:
+            directory = os.path.abspath(directory)
+
+            git(directory, 'init', '-q')
+            changed = os.path.join(directory, 'changed.py')
+            untouched = os.path.join(directory, 'untouched.py')
+            for name in [changed, untouched]:
+                with open(name, 'w') as output:
+                    output.write('import os\nimport re\nx = 1\n')
+            git(directory, 'add', '.')
+            git(directory, 'commit', '-q', '-m', 'Initial')
+
+            with open(changed, 'w') as output:
+                output.write('import os\nimport re\nimport sys\nx = 1\n')
+
+            cwd = os.getcwd()
+            os.chdir(directory)
+            try:
+                output_file = io.StringIO()
+                status = autoflake._main(
+                    argv=['my_fake_program', '--diff-only=HEAD',
+                          changed, untouched],
+                    standard_out=output_file,
+                    standard_error=None)
+            finally:
+                os.chdir(cwd)
+
+        self.assertEqual(0, status)
+        self.assertEqual("""\
+ import os
+ import re
+-import sys
+ x = 1
+""", '\n'.join(output_file.getvalue().split('\n')[3:]))
+
+    def test_diff_only_with_unusual_paths(self):
+        with temporary_directory() as directory:
+            directory = os.path.abspath(directory)
+
+            # git ends headers of paths with spaces with a tab, and quotes
+            # paths with special characters.
+            names = ['with space.py']
+            if os.name != 'nt':
+                names.append('with "quote" and \\\\.py')
+            filenames = [os.path.join(directory, name) for name in names]
+
+            git(directory, 'init', '-q')
+            for name in filenames:
+                with open(name, 'w') as output:
+                    output.write('import os\nx = 1\n')
+            git(directory, 'add', '.')
+            git(directory, 'commit', '-q', '-m', 'Initial')
+            for name in filenames:
+                with open(name, 'w') as output:
+                    output.write('import os\nimport re\nx = 1\n')
+
+            cwd = os.getcwd()
+            os.chdir(directory)
+            try:
+                output_file = io.StringIO()
+                status = autoflake._main(
+                    argv=['my_fake_program', '--diff-only=HEAD'] + filenames,
+                    standard_out=output_file,
+                    standard_error=None)
+            finally:
+                os.chdir(cwd)
+
+        self.assertEqual(0, status)
+        self.assertEqual(len(filenames),
+                         output_file.getvalue().count('-import re'))
+        self.assertNotIn('-import os', output_file.getvalue())
+
+    def test_diff_only_with_journal(self):
+        with temporary_directory() as directory:
+            directory = os.path.abspath(directory)
+
+            git(directory, 'init', '-q')
+            filename = os.path.join(directory, 'a.py')
+            with open(filename, 'w') as output:
+                output.write('import os\nx = 1\n')
+            git(directory, 'add', '.')
+            git(directory, 'commit', '-q', '-m', 'Initial')
+            with open(filename, 'w') as output:
+                output.write('import os\nimport re\nx = 1\n')
+
+            journal = os.path.join(directory, 'journal')
+            cwd = os.getcwd()
+            os.chdir(directory)
+            try:
+                for options in [['--diff-only=HEAD'], []]:
+                    self.assertEqual(0, autoflake._main(
+                        argv=['my_fake_program', '--in-place', '--journal',
+                              journal] + options + [filename],
+                        standard_out=None,
+                        standard_error=None))
+                    with open(filename) as f:
+                        contents = f.read()
+                    if options:
+                        self.assertEqual('import os\nx = 1\n', contents)
+            finally:
+                os.chdir(cwd)
+
+        # Lines outside the diff are not complete once --diff-only is gone.
+        self.assertEqual('x = 1\n', contents)
+
+    def test_diff_only_outside_repository(self):
+        with temporary_directory(directory=tempfile.gettempdir()) as directory:
+            cwd = os.getcwd()
+            os.chdir(directory)
+            try:
+                output_file = io.StringIO()
+                status = autoflake._main(
+                    argv=['my_fake_program', '--diff-only=HEAD', 'a.py'],
+                    standard_out=output_file,
+                    standard_error=output_file)
+            finally:
+                os.chdir(cwd)
+
+        self.assertEqual(1, status)
+        self.assertIn('git', output_file.getvalue())
+
+    def test_staged(self):
+        with temporary_directory() as directory:
+            directory = os.path.abspath(directory)
+
+            git(directory, 'init', '-q')
+            clean = os.path.join(directory, 'clean.py')
+            edited = os.path.join(directory, 'edited.py')
+            script = os.path.join(directory, 'script')
+            for name in [clean, edited, script]:
+                with open(name, 'w') as output:
+                    output.write('#!/usr/bin/env python\nimport os\nx = 1\n')
+            with open(os.path.join(directory, 'notes.txt'), 'w') as output:
+                output.write('import os\n')
+            git(directory, 'add', '.')
+
+            with open(edited, 'w') as output:
+                output.write('import os\nimport re\ny = 1\n')
+
+            cwd = os.getcwd()
+            os.chdir(directory)
+            try:
+                output_file = io.StringIO()
+                status = autoflake._main(
+                    argv=['my_fake_program', '--staged'],
+                    standard_out=output_file,
+                    standard_error=None)
+                self.assertEqual(0, status)
+                self.assertEqual(
+                    ['original/clean.py', 'original/edited.py',
+                     'original/script'],
+                    [line.split()[1]
+                     for line in output_file.getvalue().splitlines()
+                     if line.startswith('--- ')])
+                self.assertNotIn('import re', output_file.getvalue())
+
+                output_file = io.StringIO()
+                status = autoflake._main(
+                    argv=['my_fake_program', '--staged', '--in-place',
+                          'edited.py'],
+                    standard_out=output_file,
+                    standard_error=None)
+                self.assertEqual(0, status)
+                self.assertEqual('', output_file.getvalue())
+                self.assertEqual('#!/usr/bin/env python\nx = 1\n',
+                                 git(directory, 'show', ':edited.py'))
+                self.assertIn('import os', git(directory, 'show', ':clean.py'))
+
+                popen = subprocess.Popen
+                commands = []
+
+                def recording_popen(command, *arguments, **options):
+                    commands.append(command)
+                    return popen(command, *arguments, **options)
+
+                subprocess.Popen = recording_popen
+                try:
+                    status = autoflake._main(
+                        argv=['my_fake_program', '--staged', '--in-place'],
+                        standard_out=output_file,
+                        standard_error=None)
+                finally:
+                    subprocess.Popen = popen
+                self.assertEqual(0, status)
+                self.assertEqual('#!/usr/bin/env python\nx = 1\n',
+                                 git(directory, 'show', ':clean.py'))
+                self.assertEqual('#!/usr/bin/env python\nx = 1\n',
+                                 git(directory, 'show', ':script'))
+                # Both fixed files are written by one git process.
+                self.assertEqual(
+                    1, sum('hash-object' in command for command in commands))
+            finally:
+                os.chdir(cwd)
+
+            # Files with unstaged changes keep them.
+            with open(edited) as input_file:
+                self.assertEqual('import os\nimport re\ny = 1\n',
+                                 input_file.read())
+            with open(clean) as input_file:
+                self.assertEqual('#!/usr/bin/env python\nx = 1\n',
+                                 input_file.read())
+
+    def test_staged_with_diff_only(self):
+        output_file = io.StringIO()
+        status = autoflake._main(
+            argv=['my_fake_program', '--staged', '--diff-only=HEAD'],
+            standard_out=output_file,
+            standard_error=output_file)
+        self.assertEqual(1, status)
+        self.assertIn('--staged', output_file.getvalue())
+
+    def test_lsp(self):
+        def frame(message):
+            body = json.dumps(message).encode('utf-8')
+            return ('Content-Length: {0}\r\n\r\n'.format(
+                len(body))).encode('ascii') + body
+
+        uri = 'file:///example.py'
+        input_stream = io.BytesIO(b''.join(frame(message) for message in [
+            {'jsonrpc': '2.0', 'id': 1, 'method': 'initialize',
+             'params': {}},
+            {'jsonrpc': '2.0', 'method': 'initialized', 'params': {}},
+            {'jsonrpc': '2.0', 'method': 'textDocument/didOpen',
+             'params': {'textDocument': {'uri': uri, 'version': 1,
+                                         'text': 'import os\n'}}},
+            {'jsonrpc': '2.0', 'id': 2, 'method': 'textDocument/formatting',
+             'params': {'textDocument': {'uri': uri}}},
+            {'jsonrpc': '2.0', 'id': 3, 'method': 'shutdown'},
+            {'jsonrpc': '2.0', 'method': 'exit'},
+        ]))
+        output_stream = io.BytesIO()
+
+        self.assertEqual(0, autoflake.LanguageServer({}).serve(
+            input_stream, output_stream))
+
+        output_stream.seek(0)
+        responses = []
+        while True:
+            message = autoflake.read_message(output_stream)
+            if message is None:
+                break
+            responses.append(message)
+
+        self.assertEqual([1, 2, 3],
+                         [response['id'] for response in responses])
+        self.assertEqual(
+            2, responses[0]['result']['capabilities']['textDocumentSync'][
+                'change'])
+        self.assertEqual([{'range': {'start': {'line': 0, 'character': 0},
+                                     'end': {'line': 1, 'character': 0}},
+                           'newText': ''}],
+                         responses[1]['result'])
+
+    def test_persistent_worker(self):
+        with temporary_file('import os\nx = 1\n') as filename:
+            with temporary_file(filename + '\n', suffix='.txt') as flag_file:
+                input_stream = io.StringIO(
+                    json.dumps({'arguments': ['@' + flag_file],
+                                'requestId': 5}) + '\n' +
+                    json.dumps({'arguments': ['--jobs=x', filename]}) +
+                    '\n{"arguments": [\n' +
+                    json.dumps({'requestId': 5, 'cancel': True}) + '\n' +
+                    json.dumps({'arguments': [filename],
+                                'requestId': 6}) + '\n')
+                output_stream = io.StringIO()
+
+                self.assertEqual(0, autoflake.serve_persistent_worker(
+                    ['--jobs=1'], input_stream, output_stream))
+
+        responses = [json.loads(line)
+                     for line in output_stream.getvalue().splitlines()]
+        self.assertEqual([(0, 5), (2, 0), (1, 0), (0, 6)],
+                         [(response['exitCode'], response['requestId'])
+                          for response in responses])
+        self.assertIn('-import os', responses[0]['output'])
+        self.assertIn('--jobs', responses[1]['output'])
+        self.assertIn('invalid work request', responses[2]['output'])
+        # A malformed request does not affect the ones after it.
+        self.assertIn('-import os', responses[3]['output'])
+
+    def test_watch(self):
+        class FakeWatcher(object):
+
+            def __init__(self, batches):
+                self.batches = batches
+
+            def changes(self, timeout=None):
+                if not self.batches:
+                    raise KeyboardInterrupt
+                return self.batches.pop(0)
+
+        with temporary_file('import os\nx = 1\n') as filename:
+            calls = []
+            original_fix_code = autoflake.fix_code
+
+            def fix_code(source, **options):
+                calls.append(source)
+                return original_fix_code(source, **options)
+
+            import argparse
+            args = argparse.Namespace(
+                imports=None,
+                expand_star_imports=False,
+                remove_all_unused_imports=False,
+                remove_duplicate_keys=False,
+                remove_unused_variables=False,
+                in_place=True,
+                format='diff',
+                timeout=None,
+                changed_lines=None,
+                fsync='none')
+            output_file = io.StringIO()
+
+            # A burst of two changes, then autoflake's own write.
+            watcher = FakeWatcher([set([filename]), set([filename]), set(),
+                                   set([filename]), set()])
+            autoflake.fix_code = fix_code
+            try:
+                with self.assertRaises(KeyboardInterrupt):
+                    autoflake.watch(args, output_file, output_file, watcher)
+            finally:
+                autoflake.fix_code = original_fix_code
+
+            self.assertEqual(['import os\nx = 1\n'], calls)
+            with open(filename) as input_file:
+                self.assertEqual('x = 1\n', input_file.read())
+
     def test_with_missing_file(self):
         output_file = io.StringIO()
         ignore = StubFile()
@@ -1539,6 +2974,14 @@ def temporary_file(contents, directory='.', suffix='.py', prefix=''):
         os.remove(f.name)
 
 
+def git(directory, *arguments):
+    """Run git in directory and return its output."""
+    return subprocess.check_output(
+        ['git', '-c', 'user.name=test', '-c', 'user.email=test',
+         '-c', 'commit.gpgsign=false'] + list(arguments),
+        cwd=directory).decode('utf-8')
+
+
 @contextlib.contextmanager
 def temporary_directory(directory='.', prefix='tmp.'):
     """Create temporary directory and yield its path."""
@@ -14,6 +14,7 @@ import os
 import shlex
 import subprocess
 import sys
+import time
 
 import autoflake
 
@@ -132,6 +133,136 @@ def check_syntax(filename, raise_error=False):
                 return False
 
 
+def fuzz_file(filename, options):
+    """Fix file at filename in memory with fix_code() options.
+
+    Return (filename, error, seconds), where error is None on success.
+    """
+    try:
+        with autoflake.open_with_encoding(
+                filename,
+                encoding=autoflake.detect_encoding(filename)) as input_file:
+            source = input_file.read()
+    except (IOError, UnicodeDecodeError):
+        # Only files autoflake could read are of interest.
+        return (filename, None, 0.0)
+
+    start = time.time()
+    try:
+        fixed = autoflake.fix_code(source, **options)
+    except Exception as exception:
+        return (filename, 'autoflake crashed on {0}: {1!r}'.format(
+            filename, exception), time.time() - start)
+    seconds = time.time() - start
+
+    if fixed == source:
+        return (filename, None, seconds)
+
+    if compiles(source):
+        try:
+            compile(fixed, '<string>', 'exec', dont_inherit=True)
+        except (SyntaxError, TypeError, ValueError) as exception:
+            return (filename, 'autoflake broke {0}\n{1}'.format(
+                filename, exception), seconds)
+
+    if len(autoflake.check(fixed)) > len(autoflake.check(source)):
+        return (filename, 'autoflake made {0} worse'.format(filename),
+                seconds)
+
+    return (filename, None, seconds)
+
+
+def compiles(source):
+    """Return True if source compiles."""
+    try:
+        compile(source, '<string>', 'exec', dont_inherit=True)
+        return True
+    except (SyntaxError, TypeError, ValueError):
+        return False
+
+
+def python_files(paths):
+    """Yield real paths of Python files in paths, recursively."""
+    seen = set()
+    paths = list(paths)
+    while paths:
+        name = os.path.realpath(paths.pop(0))
+        if name in seen or not os.path.exists(name):
+            continue
+        seen.add(name)
+
+        if os.path.isdir(name):
+            for root, directories, children in os.walk(unicode(name)):
+                paths += [os.path.join(root, f) for f in children
+                          if f.endswith('.py') and
+                          not f.startswith('.')]
+
+                directories[:] = [d for d in directories
+                                  if not d.startswith('.')]
+        else:
+            yield name
+
+
+def check_in_process(args, names=None):
+    """Run fix_code() on files across a pool of worker processes.
+
+    Report throughput and the slowest files. names, if given, maps file
+    paths to the names they are reported under. Return False if any file
+    was broken or made worse.
+    """
+    import functools
+    import multiprocessing
+
+    if args.files:
+        dir_paths = args.files
+    else:
+        dir_paths = [path for path in sys.path
+                     if os.path.isdir(path)]
+
+    jobs = args.jobs or autoflake.available_cpus()
+    function = functools.partial(fuzz_file,
+                                 options=autoflake.fix_code_options(args))
+    pool = multiprocessing.Pool(jobs)
+
+    start = time.time()
+    count = 0
+    failures = 0
+    timings = []
+    try:
+        for (filename, error, seconds) in pool.imap_unordered(
+                function, python_files(dir_paths), chunksize=8):
+            count += 1
+            if names and filename in names:
+                if error:
+                    error = error.replace(filename, names[filename])
+                filename = names[filename]
+            timings.append((seconds, filename))
+            if error:
+                failures += 1
+                sys.stderr.write(error + '\n')
+            elif args.verbose:
+                sys.stderr.write(colored('--->  Tested ' + filename + '\n',
+                                         YELLOW))
+    finally:
+        pool.terminate()
+        pool.join()
+    elapsed = time.time() - start
+
+    print('{0} files in {1:.1f}s with {2} workers ({3:.1f} files/sec), '
+          '{4} failures'.format(count, elapsed, jobs,
+                                count / elapsed if elapsed else 0,
+                                failures),
+          file=sys.stderr)
+    if timings and args.slowest:
+        print('Slowest files:', file=sys.stderr)
+        for (seconds, filename) in sorted(timings,
+                                          reverse=True)[:args.slowest]:
+            print('  {0:8.3f}s  {1}'.format(seconds, filename),
+                  file=sys.stderr)
+
+    return not failures
+
+
 def process_args():
     """Return processed arguments (options and positional arguments)."""
     import argparse
@@ -159,6 +290,21 @@ def process_args():
                         help='pass "--remove-unused-variables" option to '
                              'autoflake')
 
+    parser.add_argument('--in-process', action='store_true',
+                        help='fix files in memory across a pool of worker '
+                             'processes instead of running the autoflake '
+                             'command on copies of them, and report '
+                             'throughput')
+
+    parser.add_argument('-j', '--jobs', type=int, default=0,
+                        help='number of worker processes with '
+                             '--in-process; 0 uses all CPUs '
+                             '(default: %(default)s)')
+
+    parser.add_argument('--slowest', type=int, default=10, metavar='n',
+                        help='with --in-process, list the n slowest files '
+                             '(default: %(default)s)')
+
     parser.add_argument('-v', '--verbose', action='store_true',
                         help='print verbose messages')
 
@@ -240,7 +386,10 @@ def check(args):
 
 def main():
     """Run main."""
-    return 0 if check(process_args()) else 1
+    args = process_args()
+    if args.in_process:
+        return 0 if check_in_process(args) else 1
+    return 0 if check(args) else 1
 
 
 if __name__ == '__main__':
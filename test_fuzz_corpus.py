@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+
+"""Build a reproducible fuzz corpus offline and fuzz test against it.
+
+"build" samples Python files, with a fixed seed, from the locally installed
+standard library and site-packages and from any sdists or wheels given. The
+sampled files are stored by the SHA-256 of their contents, and a manifest
+lists each one with where it came from. "check" verifies the corpus against
+its manifest and runs the in-process fuzz test from test_fuzz on it, so
+every run tests the same files without network access.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import io
+import json
+import os
+import random
+import site
+import sys
+import sysconfig
+import tarfile
+import zipfile
+
+import test_fuzz
+
+
+ROOT_PATH = os.path.abspath(os.path.dirname(__file__))
+DEFAULT_CORPUS = os.path.join(ROOT_PATH, 'fuzz_corpus')
+MANIFEST_NAME = 'manifest.json'
+
+# Skip generated or vendored files that are too large to be useful.
+MAX_FILE_BYTES = 1024 * 1024
+
+
+def installed_directories():
+    """Return standard library and site-packages directories."""
+    directories = [sysconfig.get_paths()['stdlib']]
+    if hasattr(site, 'getsitepackages'):
+        directories += site.getsitepackages()
+    if hasattr(site, 'getusersitepackages'):
+        directories.append(site.getusersitepackages())
+
+    result = []
+    for directory in directories:
+        directory = os.path.realpath(directory)
+        if os.path.isdir(directory) and directory not in result:
+            result.append(directory)
+    return result
+
+
+def directory_candidates(directory, exclude=()):
+    """Yield (source, reader) for Python files under directory.
+
+    source names the file; reader() returns its contents. Directories in
+    exclude (such as site-packages inside the standard library, which is
+    sampled on its own) are not walked.
+    """
+    for root, directories, children in os.walk(directory):
+        directories.sort()
+        directories[:] = [d for d in directories
+                          if not d.startswith('.') and
+                          d != '__pycache__' and
+                          os.path.join(root, d) not in exclude]
+        for name in sorted(children):
+            if name.endswith('.py') and not name.startswith('.'):
+                path = os.path.join(root, name)
+                yield (path, _file_reader(path))
+
+
+def _file_reader(path):
+    def read():
+        with open(path, 'rb') as input_file:
+            return input_file.read(MAX_FILE_BYTES + 1)
+    return read
+
+
+def archive_candidates(path):
+    """Yield (source, reader) for Python files in an sdist or wheel."""
+    lower = path.lower()
+    if lower.endswith(('.tar.gz', '.tgz', '.tar.bz2', '.tar')):
+        with tarfile.open(path) as archive:
+            members = sorted((member for member in archive.getmembers()
+                              if member.isfile() and
+                              member.name.endswith('.py') and
+                              member.size <= MAX_FILE_BYTES),
+                             key=lambda member: member.name)
+            names = [member.name for member in members]
+
+        def tar_reader(name):
+            def read():
+                with tarfile.open(path) as archive:
+                    return archive.extractfile(name).read()
+            return read
+
+        for name in names:
+            yield (path + '!' + name, tar_reader(name))
+    elif lower.endswith(('.whl', '.zip', '.egg')):
+        with zipfile.ZipFile(path) as archive:
+            names = sorted(info.filename for info in archive.infolist()
+                           if info.filename.endswith('.py') and
+                           info.file_size <= MAX_FILE_BYTES)
+
+        def zip_reader(name):
+            def read():
+                with zipfile.ZipFile(path) as archive:
+                    return archive.read(name)
+            return read
+
+        for name in names:
+            yield (path + '!' + name, zip_reader(name))
+
+
+def archives_in(paths):
+    """Return sorted archive paths in paths, looking inside directories."""
+    archives = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, children in os.walk(path):
+                archives += [os.path.join(root, name) for name in children]
+        else:
+            archives.append(path)
+    return sorted(name for name in archives
+                  if name.lower().endswith(('.tar.gz', '.tgz', '.tar.bz2',
+                                            '.tar', '.whl', '.zip',
+                                            '.egg')))
+
+
+def build(corpus, count, seed, directories, archives):
+    """Sample count Python files into corpus and return its manifest.
+
+    The sample depends only on seed and on the files available, so the
+    same installation gives the same corpus.
+    """
+    candidates = []
+    for directory in directories:
+        candidates += directory_candidates(directory, exclude=directories)
+    for archive in archives_in(archives):
+        try:
+            candidates += archive_candidates(archive)
+        except (tarfile.TarError, zipfile.BadZipfile, IOError) as exception:
+            print('Skipping {0}: {1}'.format(archive, exception),
+                  file=sys.stderr)
+
+    generator = random.Random(seed)
+    generator.shuffle(candidates)
+
+    files = {}
+    for (source, read) in candidates:
+        if len(files) >= count:
+            break
+        try:
+            data = read()
+        except (IOError, OSError, tarfile.TarError, KeyError):
+            continue
+        if not data or len(data) > MAX_FILE_BYTES:
+            continue
+
+        digest = hashlib.sha256(data).hexdigest()
+        if digest in files:
+            continue
+
+        path = object_path(corpus, digest)
+        if not os.path.exists(path):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:
+                pass
+            with open(path, 'wb') as output:
+                output.write(data)
+        files[digest] = {'sha256': digest, 'size': len(data),
+                         'source': source}
+
+    manifest = {
+        'seed': seed,
+        'python': '.'.join(str(part) for part in sys.version_info[:3]),
+        'files': sorted(files.values(), key=lambda entry: entry['sha256']),
+    }
+    with io.open(os.path.join(corpus, MANIFEST_NAME), 'w',
+                 encoding='utf-8') as output:
+        output.write(json.dumps(manifest, indent=2, sort_keys=True,
+                                ensure_ascii=False) + '\n')
+    return manifest
+
+
+def object_path(corpus, digest):
+    """Return where the file with digest is stored in corpus."""
+    return os.path.join(corpus, 'objects', digest[:2], digest + '.py')
+
+
+def verify(corpus):
+    """Return (sources, problems found) per the manifest.
+
+    sources maps the path of each corpus file to where it was sampled from.
+    """
+    with io.open(os.path.join(corpus, MANIFEST_NAME),
+                 encoding='utf-8') as input_file:
+        manifest = json.load(input_file)
+
+    sources = {}
+    problems = []
+    for entry in manifest['files']:
+        path = object_path(corpus, entry['sha256'])
+        try:
+            with open(path, 'rb') as input_file:
+                digest = hashlib.sha256(input_file.read()).hexdigest()
+        except IOError:
+            problems.append('missing ' + path)
+            continue
+        if digest != entry['sha256']:
+            problems.append('corrupt ' + path)
+            continue
+        sources[path] = entry['source']
+    return (sources, problems)
+
+
+def process_args():
+    """Return parsed command-line arguments."""
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS,
+                        help='corpus directory (default: %(default)s)')
+    subparsers = parser.add_subparsers(dest='command')
+
+    build_parser = subparsers.add_parser('build', help='build the corpus')
+    build_parser.add_argument('--count', type=int, default=1000,
+                              help='number of files to sample '
+                                   '(default: %(default)s)')
+    build_parser.add_argument('--seed', type=int, default=0,
+                              help='random seed (default: %(default)s)')
+    build_parser.add_argument('--no-installed', action='store_true',
+                              help='do not sample the standard library and '
+                                   'site-packages')
+    build_parser.add_argument('archives', nargs='*',
+                              help='sdists, wheels, or directories of them, '
+                                   'to sample as well')
+
+    subparsers.add_parser('check', help='fuzz test against the corpus; '
+                                        'test_fuzz options may follow')
+
+    (args, remaining) = parser.parse_known_args()
+    if not args.command:
+        parser.error('a command is required')
+    if args.command == 'build' and remaining:
+        parser.error('unrecognized arguments: ' + ' '.join(remaining))
+    return (args, remaining)
+
+
+def main():
+    """Run main."""
+    (args, remaining) = process_args()
+
+    if args.command == 'build':
+        manifest = build(
+            args.corpus,
+            count=args.count,
+            seed=args.seed,
+            directories=[] if args.no_installed else installed_directories(),
+            archives=args.archives)
+        print('Stored {0} files in {1}'.format(len(manifest['files']),
+                                               args.corpus),
+              file=sys.stderr)
+        return 0
+
+    (sources, problems) = verify(args.corpus)
+    for problem in problems:
+        print(problem, file=sys.stderr)
+    if problems:
+        return 1
+
+    sys.argv = [sys.argv[0]] + remaining
+    fuzz_args = test_fuzz.process_args()
+    fuzz_args.files = sorted(sources)
+    # Report files by where they were sampled from, not by their hash.
+    names = dict((os.path.realpath(path), source)
+                 for (path, source) in sources.items())
+    return 0 if test_fuzz.check_in_process(fuzz_args, names=names) else 1
+
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main())
+    except KeyboardInterrupt:
+        sys.exit(1)